@@ -0,0 +1,59 @@
+from typing import AsyncIterator, Optional
+from loguru import logger
+from storage import get_backend
+
+
+async def upload_file(data: bytes, key: str) -> None:
+    """
+        Uploads a file to the storage
+
+        :param data: The content to upload
+        :param key: The key to upload the file to
+    """
+    await get_backend().upload_async(data, key)
+
+
+async def get_file(key: str, start: int = 0, end: Optional[int] = None, etag: Optional[str] = None) -> AsyncIterator[bytes]:
+    """
+        Opens a file and returns its content in chunks, optionally only the
+        bytes from start up to and including end.
+
+        :param etag: Only open the file if it still has this ETag, e.g. the one returned by get_file_info
+        :raises ObjectChanged: If the file does not have the given ETag (any more)
+    """
+    return await get_backend().stream_async(key, start, end, etag)
+
+
+async def get_file_info(key: str) -> Optional[dict]:
+    """
+        Returns the size, the ETag and the content type of a file, or None if
+        it does not exist.
+    """
+    return await get_backend().info_async(key)
+
+
+async def delete_file(key: str) -> None:
+    await get_backend().delete_async(key)
+    logger.info(f"Deleted file {key}")
+
+
+def iter_files(prefix: str, start_after: Optional[str] = None, page_size: int = 1000) -> AsyncIterator[str]:
+    """
+        Streams the keys below a prefix in lexicographic order.
+
+        :param prefix: The prefix to list
+        :param start_after: Only keys that sort after this key are returned
+        :param page_size: The number of keys fetched per request (at most 1000)
+    """
+    return get_backend().list_keys_async(prefix, start_after, page_size)
+
+
+async def list_files(prefix: str) -> list[str]:
+    return [key async for key in iter_files(prefix)]
+
+
+async def close() -> None:
+    """
+        Closes the connections of the async storage client, e.g. on shutdown.
+    """
+    await get_backend().close_async()
@@ -0,0 +1,125 @@
+"""
+    Measures the materials routes end to end without AWS: the app runs in
+    process on the local storage backend, optionally with an injected latency
+    per storage operation to simulate S3. Three scenarios are run one after
+    another with the same number of concurrent requests:
+
+        list      GET .../materials/?presign=true (listing from the database with download links, response cached)
+        link      GET .../materials/{filename}    (existence check in the database and presigned url)
+        download  GET of the presigned url        (served by the local backend)
+
+    Usage (from the app directory):
+
+        python -m benchmarks.materials_throughput --requests 2000 --concurrency 50 --latency-ms 20 --no-presign-cache
+
+    Uses a temporary SQLite database unless DATABASE_URL is set.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from io import BytesIO
+
+
+def _configure(args, workdir: str) -> None:
+    # must happen before the app modules read their settings
+    os.environ["STORAGE_BACKEND"] = "local"
+    os.environ["STORAGE_LOCAL_ROOT"] = os.path.join(workdir, "storage")
+    os.environ["STORAGE_LOCAL_BASE_URL"] = "http://bench"
+    os.environ["STORAGE_LATENCY_MS"] = str(args.latency_ms)
+    os.environ["RATE_LIMIT_DEFAULT"] = "1000000/minute"
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    if args.no_presign_cache:
+        os.environ["S3_PRESIGN_CACHE_SIZE"] = "0"
+
+
+def _seed(files: int) -> list[str]:
+    import main  # noqa: F401, sets up the logger that is removed below
+    import models
+    import storage
+    from db import Session, engine
+    from lecture_materials import sync_materials
+    from migrate import upgrade_database
+    from loguru import logger
+
+    logger.remove()
+    upgrade_database(engine)
+    session = Session()
+    if session.query(models.User).filter(models.User.id == "bench_user").count() == 0:
+        session.add(models.User(id="bench_user", name="bench_user", role=models.UserRole.student))
+        session.add(models.Course(id="bench_course", name="bench_course"))
+        session.add(models.Lecture(id="bench_lecture", course_id="bench_course", name="bench_lecture"))
+        session.add(models.CourseMembership(user_id="bench_user", course_id="bench_course", is_instructor=False))
+        session.commit()
+    session.close()
+    filenames = [f"file_{i}.pdf" for i in range(files)]
+    for filename in filenames:
+        storage.upload_file(BytesIO(b"x" * 1024), f"bench_course/bench_lecture/{filename}")
+    session = Session()
+    sync_materials(session, "bench_course/")
+    session.commit()
+    session.close()
+    return filenames
+
+
+async def _run(client, urls: list[str], requests: int, concurrency: int, headers: dict) -> list[float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def request(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            res = await client.get(urls[i % len(urls)], headers=headers)
+            res.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[request(i) for i in range(requests)])
+    return latencies
+
+
+def _report(name: str, latencies: list[float], elapsed: float) -> None:
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    print(f"{name:9}: {len(latencies) / elapsed:10.1f} req/s   p50 {p50:8.2f} ms   p99 {p99:8.2f} ms")
+
+
+async def _benchmark(args, filenames: list[str]) -> None:
+    import httpx
+    from main import app
+    from utils import generate_mock_jwt
+
+    headers = {"Authorization": "Bearer " + generate_mock_jwt("bench_user")}
+    base = "/courses/bench_course/lectures/bench_lecture/materials"
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        links = [(await client.get(f"{base}/{filename}", headers=headers)).json() for filename in filenames]
+        scenarios = [
+            ("list", [f"{base}/?presign=true"]),
+            ("link", [f"{base}/{filename}" for filename in filenames]),
+            ("download", links),
+        ]
+        for name, urls in scenarios:
+            start = time.perf_counter()
+            latencies = await _run(client, urls, args.requests, args.concurrency, headers)
+            _report(name, latencies, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Added to every storage operation")
+    parser.add_argument("--no-presign-cache", action="store_true", help="Disable the presigned url cache")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        _configure(args, workdir)
+        filenames = _seed(args.files)
+        print(f"requests={args.requests} concurrency={args.concurrency} files={args.files} latency={args.latency_ms}ms presign_cache={not args.no_presign_cache}")
+        asyncio.run(_benchmark(args, filenames))
+
+
+if __name__ == "__main__":
+    main()
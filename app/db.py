@@ -1,16 +1,180 @@
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession as AsyncSessionType
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.dialects import postgresql, sqlite
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
+from bisect import bisect_left
+from typing import Optional
+from threading import Lock
+import time
 import os
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+DATABASE_ASYNC = os.getenv("DATABASE_ASYNC", "false").lower() == "true"
+
+_ASYNC_DRIVERS = {
+    "postgresql": "asyncpg",
+    "sqlite": "aiosqlite",
+}
+
+# INSERT constructs with ON CONFLICT support
+_DIALECT_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+# upper bounds (in milliseconds) of the checkout wait time histogram buckets
+_CHECKOUT_WAIT_BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000]
 
 Session = None
+AsyncSession = None
+async_engine = None
+
+
+class _CheckoutWaitStats:
+    """
+        Records how long callers wait to check out a connection of a queue
+        pool.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = Lock()
+        self._wait_buckets = [0] * (len(_CHECKOUT_WAIT_BUCKETS_MS) + 1)
+        self._wait_total_ms = 0.0
+        self._checkouts = 0
+        self._timeouts = 0
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            with self._stats_lock:
+                self._timeouts += 1
+            raise
+        finally:
+            waited_ms = (time.perf_counter() - start) * 1000
+            with self._stats_lock:
+                self._wait_buckets[bisect_left(_CHECKOUT_WAIT_BUCKETS_MS, waited_ms)] += 1
+                self._wait_total_ms += waited_ms
+                self._checkouts += 1
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            buckets = {f"le_{bound}ms": count for bound, count in zip(_CHECKOUT_WAIT_BUCKETS_MS, self._wait_buckets)}
+            buckets["inf"] = self._wait_buckets[-1]
+            return {
+                "size": self.size(),
+                "checked_out": self.checkedout(),
+                "checked_in": self.checkedin(),
+                "overflow": max(self.overflow(), 0),
+                "max_overflow": self._max_overflow,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "checkout_wait_ms_total": round(self._wait_total_ms, 3),
+                "checkout_wait_ms_histogram": buckets,
+            }
+
+
+class InstrumentedQueuePool(_CheckoutWaitStats, QueuePool):
+    """
+        QueuePool that records how long callers wait to check out a connection.
+    """
+
+
+class InstrumentedAsyncQueuePool(_CheckoutWaitStats, AsyncAdaptedQueuePool):
+    """
+        The pool of the async engine, which cannot use a plain QueuePool.
+    """
+
+
+def _pool_options(poolclass=InstrumentedQueuePool) -> dict:
+    return {
+        "poolclass": poolclass,
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+    }
+
+
+def to_async_url(url: str) -> str:
+    """
+        Derives the URL for the async engine from the sync DATABASE_URL,
+        e.g. postgresql://... becomes postgresql+asyncpg://...
+    """
+    url = make_url(url)
+    return url.set(drivername=f"{url.get_backend_name()}+{_ASYNC_DRIVERS[url.get_backend_name()]}").render_as_string(hide_password=False)
+
+
+def dialect_insert(session, table):
+    """
+        Returns an INSERT for the database of the session that supports
+        on_conflict_do_nothing and on_conflict_do_update.
+
+        :param table: A model or a table
+    """
+    return _DIALECT_INSERTS[session.get_bind().dialect.name](table)
+
+
+async def read_all(session, statement) -> list:
+    """
+        Runs a select and returns all rows, on the event loop with an
+        AsyncSession and in the thread pool with a sync Session, so async
+        routes can read through either (see dependencies.get_read_session).
+    """
+    if isinstance(session, AsyncSessionType):
+        return (await session.execute(statement)).all()
+    return await run_in_threadpool(lambda: session.execute(statement).all())
+
+
+async def read_scalars(session, statement) -> list:
+    """
+        Like read_all, but returns the first column of every row, e.g. the
+        entities of select(Model).
+    """
+    if isinstance(session, AsyncSessionType):
+        return (await session.scalars(statement)).all()
+    return await run_in_threadpool(lambda: session.scalars(statement).all())
+
+
+def _engine_options(url: str, poolclass) -> dict:
+    # SQLite picks its own pool implementation, the pool options only apply to server databases
+    return {} if make_url(url).get_backend_name() == "sqlite" else _pool_options(poolclass)
+
+
+def _pool_stats(pool) -> dict:
+    if isinstance(pool, _CheckoutWaitStats):
+        return pool.stats()
+    return {"status": pool.status()}
+
+
+def get_pool_stats() -> dict:
+    return _pool_stats(engine.pool)
+
+
+def get_async_pool_stats() -> Optional[dict]:
+    """
+        Returns the statistics of the async engine's pool, or None if the
+        async database mode is off.
+    """
+    return _pool_stats(async_engine.pool) if async_engine is not None else None
+
 
 if DATABASE_URL is not None:
-    engine = create_engine(DATABASE_URL)
+    engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL, InstrumentedQueuePool))
     Session = sessionmaker(bind=engine)
+    if DATABASE_ASYNC:
+        async_url = os.getenv("ASYNC_DATABASE_URL", to_async_url(DATABASE_URL))
+        async_engine = create_async_engine(async_url, **_engine_options(async_url, InstrumentedAsyncQueuePool))
+        AsyncSession = async_sessionmaker(bind=async_engine, expire_on_commit=False)
 else:
     raise ValueError("DATABASE_URL environment variable not set")
@@ -1,10 +1,12 @@
-from fastapi import Depends, HTTPException, Header
-from db import Session
+from fastapi import Depends, HTTPException, Header, Request
+from db import Session, AsyncSession, read_all
+from sqlalchemy import select
 from sqlalchemy.exc import NoResultFound
 import models
-from storage import list_files
+from principal_cache import principal_cache
 import jwt
 from loguru import logger
+from typing import Optional
 
 
 def get_session():
@@ -17,58 +19,130 @@ def get_session():
         session.close()
 
 
-def decode_token(authorization: str = Header(description='A bearer token'), session=Depends(get_session)):
-    logger.trace("Decoding token")
+async def get_read_session(session=Depends(get_session)):
+    """
+        Yields an AsyncSession in async database mode (DATABASE_ASYNC=true),
+        so read routes query on the event loop, and the sync session of the
+        request otherwise. Read through it with db.read_all, db.read_scalars
+        or pagination.paginate_select.
+    """
+    if AsyncSession is None:
+        yield session
+        return
+    logger.trace("Creating async session")
+    async with AsyncSession() as async_session:
+        yield async_session
+    logger.trace("Closed async session")
+
+
+def _get_bearer_token(authorization: Optional[str]) -> Optional[str]:
+    if authorization is None:
+        return None
+    parts = authorization.split(" ")
+    return parts[1] if len(parts) > 1 else None
+
+
+def _decode_token(token: str) -> Optional[dict]:
     try:
-        token = authorization.split(" ")[1]
-        payload = jwt.decode(token, "secret", algorithms=["HS256"])
-        user = session.query(models.User).filter(
-            models.User.id == payload["sub"]).all()
-        if user == []:
-            raise HTTPException(status_code=404, detail="User not found")
-        return {
-            "role": user[0].role,
-            "id": user[0].id,
-            "name": user[0].name
+        return jwt.decode(token, "secret", algorithms=["HS256"])
+    except Exception:
+        return None
+
+
+async def get_request_context(request: Request, authorization: Optional[str] = Header(default=None, description='A bearer token'), session=Depends(get_read_session)) -> dict:
+    """
+        Resolves the principal, its access to the course and lecture of the
+        current path and the existence of the path's lecture material in a
+        single query. FastAPI caches dependencies per request,
+        so every other dependency in this module reads from the same result.
+        Verified principals are served from the principal cache when possible.
+        The query runs on the event loop in async database mode, and the
+        dependencies below are async, so they do not take a thread pool slot.
+    """
+    token = _get_bearer_token(authorization)
+    user = principal_cache.get(token) if token is not None else None
+    payload = _decode_token(token) if token is not None and user is None else None
+    user_id = user["id"] if user is not None else payload.get("sub") if payload is not None else None
+    course_id = request.path_params.get("course_id")
+    lecture_id = request.path_params.get("lecture_id")
+    filename = request.path_params.get("filename")
+
+    columns = []
+    if user_id is not None:
+        if user is None:
+            columns += [
+                select(models.User.name).where(models.User.id == user_id).scalar_subquery().label("user_name"),
+                select(models.User.role).where(models.User.id == user_id).scalar_subquery().label("user_role"),
+            ]
+        if course_id is not None:
+            membership = select(models.CourseMembership).where(
+                models.CourseMembership.user_id == user_id, models.CourseMembership.course_id == course_id)
+            columns += [
+                membership.exists().label("is_member"),
+                membership.where(models.CourseMembership.is_instructor.is_(True)).exists().label("is_instructor"),
+            ]
+    if course_id is not None:
+        columns.append(select(models.Course.id).where(models.Course.id == course_id).exists().label("course_exists"))
+    if lecture_id is not None:
+        lecture = select(models.Lecture.id).where(models.Lecture.id == lecture_id)
+        if course_id is not None:
+            # a lecture of another course does not exist below this course
+            lecture = lecture.where(models.Lecture.course_id == course_id)
+        columns.append(lecture.exists().label("lecture_exists"))
+        if filename is not None:
+            columns.append(select(models.LectureMaterial.filename).where(
+                models.LectureMaterial.lecture_id == lecture_id, models.LectureMaterial.filename == filename).exists().label("material_exists"))
+
+    logger.trace("Resolving request context")
+    row = (await read_all(session, select(*columns)))[0]._mapping if columns else {}
+
+    if user is None and row.get("user_role") is not None:
+        user = {
+            "role": row["user_role"],
+            "id": user_id,
+            "name": row["user_name"]
         }
-    except:
+        principal_cache.put(token, user, payload.get("exp"))
+    return {
+        "user": user,
+        "is_member": bool(row.get("is_member", False)),
+        "is_instructor": bool(row.get("is_instructor", False)),
+        "course_exists": bool(row.get("course_exists", False)),
+        "lecture_exists": bool(row.get("lecture_exists", False)),
+        "material_exists": bool(row.get("lecture_exists", False) and row.get("material_exists", False)),
+    }
+
+
+async def decode_token(context=Depends(get_request_context)):
+    logger.trace("Decoding token")
+    if context["user"] is None:
         raise HTTPException(status_code=401, detail="Invalid token")
+    return context["user"]
 
 
-def is_course_instructor(course_id: str, user=Depends(decode_token), session=Depends(get_session)) -> bool:
-    try:
-        session.query(models.CourseMembership).filter(
-            models.CourseMembership.user_id == user["id"]).filter(models.CourseMembership.course_id == course_id).filter(models.CourseMembership.is_instructor.is_(True)).one()
-        return True
-    except NoResultFound:
-        return False
-    
-
-def is_member_of_course(course_id: str, user=Depends(decode_token), session=Depends(get_session)) -> bool:
-    try:
-        session.query(models.CourseMembership).filter(
-            models.CourseMembership.user_id == user["id"]).filter(models.CourseMembership.course_id == course_id).one()
-        return True
-    except NoResultFound:
-        return False
+async def is_course_instructor(user=Depends(decode_token), context=Depends(get_request_context)) -> bool:
+    return context["is_instructor"]
 
 
-def check_if_course_exists(course_id: str, session=Depends(get_session)):
-    try:
-        session.query(models.Course).filter(
-            models.Course.id == course_id).one()
-    except NoResultFound:
+async def is_member_of_course(user=Depends(decode_token), context=Depends(get_request_context)) -> bool:
+    return context["is_member"]
+
+
+async def check_if_course_member(user=Depends(decode_token), is_member=Depends(is_member_of_course)):
+    if not is_member and user["role"] is not models.UserRole.admin:
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
+async def check_if_course_exists(context=Depends(get_request_context)):
+    if not context["course_exists"]:
         raise HTTPException(status_code=404, detail="Course not found")
 
 
-def check_if_lecture_exists(lecture_id: str, session=Depends(get_session)):
-    try:
-        session.query(models.Lecture).filter(
-            models.Lecture.id == lecture_id).one()
-    except NoResultFound:
+async def check_if_lecture_exists(context=Depends(get_request_context)):
+    if not context["lecture_exists"]:
         raise HTTPException(status_code=404, detail="Lecture not found")
 
 
-def check_if_file_exists(filename: str):
-    if list_files(filename) == []:
+async def check_if_file_exists(context=Depends(get_request_context)):
+    if not context["material_exists"]:
         raise HTTPException(status_code=404, detail="File not found")
@@ -0,0 +1,215 @@
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+from loguru import logger
+from db import Session
+import models
+import storage
+import asyncio
+import dotenv
+import os
+import uuid
+
+dotenv.load_dotenv()
+
+_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+# a running job whose worker has not reported back after this many seconds is picked up again
+_LEASE_TIMEOUT = float(os.getenv("JOB_LEASE_TIMEOUT", "600"))
+# multipart uploads that were neither completed nor aborted after this many seconds are aborted
+_MULTIPART_UPLOAD_MAX_AGE = float(os.getenv("MULTIPART_UPLOAD_MAX_AGE", str(24 * 60 * 60)))
+_MULTIPART_CLEANUP_INTERVAL = float(os.getenv("MULTIPART_CLEANUP_INTERVAL", str(60 * 60)))
+
+_workers: list[asyncio.Task] = []
+
+
+def _now() -> datetime:
+    return datetime.utcnow()
+
+
+class IdempotencyKeyConflict(Exception):
+    """
+        The idempotency key was already used by another user or for another
+        prefix.
+    """
+
+
+def find_storage_cleanup(session, idempotency_key: Optional[str], created_by: Optional[str], prefix: str) -> Optional[models.StorageCleanupJob]:
+    """
+        Returns the job that was added with the idempotency key, e.g. by the
+        first attempt of a retried request.
+
+        :raises IdempotencyKeyConflict: If the job was added by another user or for another prefix
+    """
+    if idempotency_key is None:
+        return None
+    job = session.query(models.StorageCleanupJob).filter(
+        models.StorageCleanupJob.idempotency_key == idempotency_key).one_or_none()
+    if job is not None and (job.created_by != created_by or job.prefix != prefix):
+        raise IdempotencyKeyConflict(idempotency_key)
+    return job
+
+
+def enqueue_storage_cleanup(session, prefix: str, created_by: Optional[str] = None, idempotency_key: Optional[str] = None) -> models.StorageCleanupJob:
+    """
+        Adds a job that deletes every object below the prefix. The job is only
+        added to the session, so it is committed together with the caller's
+        database changes.
+
+        :param idempotency_key: If the same user added a job for the prefix with this key already, that job is returned instead
+        :raises IdempotencyKeyConflict: If the key was used by another user or for another prefix
+    """
+    job = find_storage_cleanup(session, idempotency_key, created_by, prefix)
+    if job is not None:
+        return job
+    job = session.query(models.StorageCleanupJob).filter(
+        models.StorageCleanupJob.prefix == prefix, models.StorageCleanupJob.status == models.JobStatus.pending).first()
+    if job is not None:
+        return job
+    now = _now()
+    job = models.StorageCleanupJob(
+        id=str(uuid.uuid4()),
+        idempotency_key=idempotency_key,
+        prefix=prefix,
+        status=models.JobStatus.pending,
+        attempts=0,
+        created_by=created_by,
+        run_after=now,
+        created_at=now,
+        updated_at=now,
+    )
+    session.add(job)
+    return job
+
+
+def commit_storage_cleanup(session, job: models.StorageCleanupJob) -> models.StorageCleanupJob:
+    """
+        Commits the caller's transaction together with a job returned by
+        enqueue_storage_cleanup. If a concurrent request committed a job with
+        the same idempotency key first, the transaction is rolled back and that
+        job is returned instead, as for a retry.
+
+        :raises IdempotencyKeyConflict: If the concurrent request was made by another user or for another prefix
+    """
+    idempotency_key, created_by, prefix = job.idempotency_key, job.created_by, job.prefix
+    try:
+        session.commit()
+        return job
+    except IntegrityError:
+        session.rollback()
+        existing = find_storage_cleanup(session, idempotency_key, created_by, prefix)
+        if existing is None:
+            raise
+        logger.info(f"Idempotency key {idempotency_key} was used by a concurrent request, returning its job {existing.id}")
+        return existing
+
+
+def _claim_job(session_factory) -> Optional[tuple[str, str]]:
+    session = session_factory()
+    try:
+        now = _now()
+        job = session.query(models.StorageCleanupJob).filter(or_(
+            (models.StorageCleanupJob.status == models.JobStatus.pending) & (models.StorageCleanupJob.run_after <= now),
+            (models.StorageCleanupJob.status == models.JobStatus.running) & (
+                models.StorageCleanupJob.updated_at <= now - timedelta(seconds=_LEASE_TIMEOUT)),
+        )).order_by(models.StorageCleanupJob.run_after).with_for_update(skip_locked=True).first()
+        if job is None:
+            return None
+        job.status = models.JobStatus.running
+        job.attempts += 1
+        job.updated_at = now
+        claimed = job.id, job.prefix
+        session.commit()
+        return claimed
+    finally:
+        session.close()
+
+
+def _finish_job(session_factory, job_id: str, error: Optional[str]) -> None:
+    session = session_factory()
+    try:
+        job = session.query(models.StorageCleanupJob).filter(models.StorageCleanupJob.id == job_id).one()
+        now = _now()
+        job.updated_at = now
+        job.last_error = error
+        if error is None:
+            job.status = models.JobStatus.succeeded
+        elif job.attempts >= _MAX_ATTEMPTS:
+            job.status = models.JobStatus.failed
+        else:
+            job.status = models.JobStatus.pending
+            job.run_after = now + timedelta(seconds=2 ** job.attempts)
+        session.commit()
+    finally:
+        session.close()
+
+
+def process_next_job(session_factory=Session) -> bool:
+    """
+        Claims and runs the next due job.
+
+        :return: False if there was no job to run
+    """
+    claimed = _claim_job(session_factory)
+    if claimed is None:
+        return False
+    job_id, prefix = claimed
+    logger.trace(f"Running storage cleanup job {job_id} for {prefix}")
+    try:
+        failures = storage.delete_prefix(prefix)
+        error = f"Could not delete {len(failures)} files, e.g. {failures[0]['key']}: {failures[0]['code']}" if failures else None
+    except Exception as e:
+        error = repr(e)
+    _finish_job(session_factory, job_id, error)
+    if error is None:
+        logger.info(f"Finished storage cleanup job {job_id}")
+    else:
+        logger.warning(f"Storage cleanup job {job_id} failed: {error}")
+    return True
+
+
+async def _worker():
+    while True:
+        try:
+            if await run_in_threadpool(process_next_job):
+                continue
+        except Exception as e:
+            logger.error(f"Job worker error: {e!r}")
+        await asyncio.sleep(_POLL_INTERVAL)
+
+
+def abort_stale_multipart_uploads() -> int:
+    """
+        Aborts the multipart uploads of lecture materials that were started
+        more than MULTIPART_UPLOAD_MAX_AGE seconds ago, e.g. by clients that
+        gave up. Their parts would otherwise be kept forever.
+
+        :return: The number of aborted uploads
+    """
+    return storage.abort_multipart_uploads("", _MULTIPART_UPLOAD_MAX_AGE)
+
+
+async def _multipart_cleanup_worker():
+    while True:
+        try:
+            await run_in_threadpool(abort_stale_multipart_uploads)
+        except Exception as e:
+            logger.error(f"Multipart upload cleanup error: {e!r}")
+        await asyncio.sleep(_MULTIPART_CLEANUP_INTERVAL)
+
+
+def start_workers(count: int) -> None:
+    for _ in range(count):
+        _workers.append(asyncio.create_task(_worker()))
+    if count > 0:
+        _workers.append(asyncio.create_task(_multipart_cleanup_worker()))
+    logger.info(f"Started {count} job workers")
+
+
+async def stop_workers() -> None:
+    for worker in _workers:
+        worker.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
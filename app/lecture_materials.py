@@ -0,0 +1,87 @@
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import select
+from loguru import logger
+from db import dialect_insert
+import models
+import storage
+
+
+def record_material(session, lecture_id: str, filename: str, info: dict) -> None:
+    """
+        Stores the metadata of an uploaded file, replacing the metadata of an
+        earlier upload with the same name. Runs in the caller's transaction.
+
+        :param info: The size, etag and content_type of the file, see storage.get_file_info
+    """
+    insert = dialect_insert(session, models.LectureMaterial).values(
+        lecture_id=lecture_id,
+        filename=filename,
+        size=info["size"],
+        content_type=info["content_type"],
+        etag=info["etag"],
+        uploaded_at=datetime.utcnow(),
+    )
+    session.execute(insert.on_conflict_do_update(
+        index_elements=[models.LectureMaterial.lecture_id, models.LectureMaterial.filename],
+        set_={column: insert.excluded[column] for column in ("file_size", "content_type", "etag", "uploaded_at")},
+    ))
+
+
+def delete_material(session, lecture_id: str, filename: str) -> None:
+    session.query(models.LectureMaterial).filter(
+        models.LectureMaterial.lecture_id == lecture_id, models.LectureMaterial.filename == filename).delete()
+
+
+def delete_lecture_materials(session, course_id: str, lecture_id: Optional[str] = None) -> None:
+    """
+        Deletes the metadata of all files of a lecture, or of all lectures of
+        the course. Call it before deleting the lectures.
+    """
+    lecture_ids = [lecture_id] if lecture_id is not None else select(models.Lecture.id).where(models.Lecture.course_id == course_id)
+    session.query(models.LectureMaterial).filter(
+        models.LectureMaterial.lecture_id.in_(lecture_ids)).delete(synchronize_session=False)
+
+
+def sync_materials(session, prefix: str = "") -> int:
+    """
+        Rebuilds the metadata of the files below a prefix from the storage,
+        e.g. to fill the table of an existing deployment. Files of lectures
+        that do not exist are skipped. Runs in the caller's transaction.
+
+        :param prefix: "", "course_id/" or "course_id/lecture_id/"
+        :return: The number of recorded files
+    """
+    course_id, _, lecture_id = prefix.rstrip("/").partition("/")
+    query = select(models.Lecture.id, models.Lecture.course_id)
+    if course_id:
+        query = query.where(models.Lecture.course_id == course_id)
+    if lecture_id:
+        query = query.where(models.Lecture.id == lecture_id)
+    lectures = dict(session.execute(query).all())
+
+    seen = set()
+    for key in storage.iter_files(prefix):
+        parts = key.split("/", 2)
+        if len(parts) != 3 or lectures.get(parts[1]) != parts[0]:
+            continue
+        info = storage.get_file_info(key)
+        if info is not None:
+            record_material(session, parts[1], parts[2], info)
+            seen.add((parts[1], parts[2]))
+    # rows of files that were deleted from the storage in the meantime
+    for material in session.query(models.LectureMaterial).filter(models.LectureMaterial.lecture_id.in_(list(lectures))):
+        if (material.lecture_id, material.filename) not in seen:
+            session.delete(material)
+    logger.info(f"Recorded {len(seen)} files below {prefix}")
+    return len(seen)
+
+
+if __name__ == "__main__":
+    from db import Session
+    session = Session()
+    try:
+        sync_materials(session)
+        session.commit()
+    finally:
+        session.close()
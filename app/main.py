@@ -1,25 +1,40 @@
 from fastapi import FastAPI, HTTPException, Depends, Request
 import models
+from sqlalchemy import select
 import schemas
-from db import Session
 from utils import generate_mock_jwt
-from dependencies import get_session, decode_token
+from dependencies import get_session, get_read_session, decode_token
+from pagination import pagination_params, paginate_select
 
-from slowapi import Limiter, _rate_limit_exceeded_handler
+from slowapi import _rate_limit_exceeded_handler
 from slowapi.middleware import SlowAPIMiddleware
-from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
+from rate_limit import limiter
 
-from routers import courses, lectures, materials
+from routers import courses, lectures, materials, internal, local_storage, jobs as jobs_router
+import jobs
+import async_storage
+from principal_cache import principal_cache
 from loguru import logger
 import sys
 
-from fastapi_cache import FastAPICache
-from fastapi_cache.backends.inmemory import InMemoryBackend
+from response_cache import init_cache
 
 import uuid
+import os
+from contextlib import asynccontextmanager
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # run the background job workers (storage cleanup) in this worker process
+    jobs.start_workers(int(os.getenv("JOB_WORKERS", "1")))
+    yield
+    await jobs.stop_workers()
+    await async_storage.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # set log level to TRACE
 logger.remove()
@@ -29,20 +44,17 @@ logger.add(sys.stderr, level="TRACE")
 app.include_router(courses.router)
 app.include_router(lectures.router)
 app.include_router(materials.router)
+app.include_router(internal.router)
+app.include_router(jobs_router.router)
+app.include_router(local_storage.router)
 
 # set up rate limiting
-limiter = Limiter(key_func=get_remote_address, default_limits=["10/minute"])
 app.state.limiter = limiter
 app.add_middleware(SlowAPIMiddleware)
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
-# Create the database tables
-session = Session()
-models.Base.metadata.create_all(bind=session.get_bind())
-session.close()
-
 # Initialize the cache
-FastAPICache.init(InMemoryBackend())
+init_cache()
 
 
 @app.post(
@@ -73,7 +85,7 @@ def login(request: Request, login_request: schemas.LoginRequest, session=Depends
     response_model=schemas.User,
     summary='Get current user',
 )
-def get_me(user=Depends(decode_token)):
+async def get_me(user=Depends(decode_token)):
     return user
 
 
@@ -82,16 +94,18 @@ def get_me(user=Depends(decode_token)):
     response_model=schemas.GetUserResponse,
     tags=["users"],
     summary='Get all users',
-    description='Get all users in the system. Only teachers and admins can access this endpoint.',
+    description='Get all users in the system, sorted by id and paginated (50 per page by default). Pass the returned next_cursor as cursor to get the next page. Only teachers and admins can access this endpoint.',
     responses={
         403: {"description": "Forbidden"}
     }
 )
-async def get_users(session=Depends(get_session), user=Depends(decode_token)):
+async def get_users(session=Depends(get_read_session), user=Depends(decode_token), pagination=Depends(pagination_params)):
     if user["role"] not in [models.UserRole.admin, models.UserRole.teacher]:
         raise HTTPException(status_code=403, detail="Forbidden")
+    users, next_cursor = await paginate_select(session, select(models.User), models.User.id, models.User.name, pagination, default_limit=50)
     return {
-        "data": session.query(models.User).all()
+        "data": users,
+        "next_cursor": next_cursor
     }
 
 
@@ -109,26 +123,53 @@ def create_user(user: schemas.PostUserRequest, session=Depends(get_session), cur
     if current_user["role"] is not models.UserRole.admin:
         raise HTTPException(
             status_code=403, detail="Only admins can create users")
+    user_id = str(uuid.uuid4())
     session.add(models.User(
         name=user.name,
-        id=str(uuid.uuid4()),
+        id=user_id,
         role=user.role
     ))
     session.commit()
     logger.info(f"Created user {user.name}")
 
 
+@app.put(
+    "/users/{user_id}/role",
+    status_code=204,
+    tags=["users"],
+    summary='Change the role of a user',
+    description='Change the role of a user. Only admins can access this endpoint. The new role applies to the next request handled by this worker; other workers may keep the old role for up to PRINCIPAL_CACHE_TTL seconds.',
+    responses={
+        403: {"description": "Forbidden"},
+        404: {"description": "User not found"}
+    }
+)
+def update_user_role(user_id: str, body: schemas.UpdateUserRoleRequest, session=Depends(get_session), current_user=Depends(decode_token)):
+    if current_user["role"] is not models.UserRole.admin:
+        raise HTTPException(
+            status_code=403, detail="Only admins can change roles")
+    if session.query(models.User).filter(models.User.id == user_id).update({"role": body.role}) == 0:
+        raise HTTPException(status_code=404, detail="User not found")
+    session.commit()
+    # cached principals carry the role
+    principal_cache.invalidate_user(user_id)
+    logger.info(f"Changed the role of user {user_id} to {body.role.value}")
+
+
 @app.get(
     "/my/courses",
-    response_model=schemas.GetCourseResponse,
+    response_model=schemas.GetCoursesResponse,
     summary='Get my courses',
-    description='Get all courses that the currently authenticated user is enrolled in.',
+    description='Get all courses that the currently authenticated user is enrolled in, sorted by id and paginated (50 per page by default). Pass the returned next_cursor as cursor to get the next page.',
     tags=["courses"],
     responses={
         403: {"description": "Forbidden"}
     }
 )
-def get_my_courses(session=Depends(get_session), user=Depends(decode_token)):
+async def get_my_courses(session=Depends(get_read_session), user=Depends(decode_token), pagination=Depends(pagination_params)):
+    query = select(models.Course).join(models.CourseMembership, models.CourseMembership.course_id == models.Course.id).where(models.CourseMembership.user_id == user["id"])
+    courses, next_cursor = await paginate_select(session, query, models.Course.id, models.Course.name, pagination, default_limit=50)
     return {
-        "data": session.query(models.Course).join(models.CourseMembership, models.CourseMembership.course_id == models.Course.id).filter(models.CourseMembership.user_id == user["id"]).all()
+        "data": courses,
+        "next_cursor": next_cursor
     }
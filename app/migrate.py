@@ -0,0 +1,43 @@
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import inspect, text
+from loguru import logger
+import os
+
+_ALEMBIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini")
+# the schema that create_all produced before migrations were introduced
+_BASELINE_REVISION = "0001"
+# serializes concurrent runs on PostgreSQL, e.g. several containers starting at once
+_ADVISORY_LOCK_ID = 7_350_113
+
+
+def _alembic_config(connection) -> Config:
+    config = Config(_ALEMBIC_INI)
+    config.set_main_option("script_location", os.path.join(os.path.dirname(_ALEMBIC_INI), "migrations"))
+    config.attributes["connection"] = connection
+    return config
+
+
+def upgrade_database(engine) -> None:
+    """
+        Applies all pending migrations. Databases that were created with
+        create_all before migrations were introduced are stamped with the
+        baseline revision first, so only the later revisions run on them.
+        On PostgreSQL a transaction scoped advisory lock makes concurrent
+        runs wait for each other.
+    """
+    with engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            connection.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": _ADVISORY_LOCK_ID})
+        config = _alembic_config(connection)
+        tables = inspect(connection).get_table_names()
+        if "alembic_version" not in tables and "users" in tables:
+            logger.info(f"Stamping existing database with revision {_BASELINE_REVISION}")
+            command.stamp(config, _BASELINE_REVISION)
+        command.upgrade(config, "head")
+
+
+if __name__ == "__main__":
+    # run before the server starts: python migrate.py
+    from db import engine
+    upgrade_database(engine)
@@ -0,0 +1,35 @@
+from alembic import context
+import models
+
+target_metadata = models.Base.metadata
+
+
+def run_migrations_offline():
+    from db import DATABASE_URL
+    context.configure(url=DATABASE_URL, target_metadata=target_metadata, literal_binds=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    # migrate.upgrade_database passes its own connection, the alembic command line uses the app's engine
+    connection = context.config.attributes.get("connection")
+    if connection is None:
+        from db import engine
+        with engine.connect() as connection:
+            _run_migrations(connection)
+    else:
+        _run_migrations(connection)
+
+
+def _run_migrations(connection):
+    # SQLite can only alter tables by copying them, batch mode does that for us
+    context.configure(connection=connection, target_metadata=target_metadata, render_as_batch=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
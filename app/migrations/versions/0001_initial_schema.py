@@ -0,0 +1,65 @@
+"""initial schema
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-17 09:12:41.503218
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'users',
+        sa.Column('user_name', sa.String(), nullable=False),
+        sa.Column('user_role', sa.Enum('teacher', 'student', 'admin', name='userrole'), nullable=False),
+        sa.Column('user_id', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+    op.create_table(
+        'courses',
+        sa.Column('course_id', sa.String(), nullable=False),
+        sa.Column('course_name', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('course_id'),
+    )
+    op.create_table(
+        'course_membership',
+        sa.Column('user_id', sa.String(), nullable=False),
+        sa.Column('course_id', sa.String(), nullable=False),
+        sa.Column('is_instructor', sa.Boolean(), nullable=False),
+        sa.ForeignKeyConstraint(['course_id'], ['courses.course_id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.user_id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id', 'course_id'),
+    )
+    op.create_table(
+        'lectures',
+        sa.Column('lecture_id', sa.String(), nullable=False),
+        sa.Column('course_id', sa.String(), nullable=False),
+        sa.Column('lecture_name', sa.String(), nullable=False),
+        sa.ForeignKeyConstraint(['course_id'], ['courses.course_id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('lecture_id'),
+    )
+    op.create_table(
+        'lecture_user_progress',
+        sa.Column('user_id', sa.String(), nullable=False),
+        sa.Column('lecture_id', sa.String(), nullable=False),
+        sa.Column('lecture_completed', sa.Boolean(), nullable=False),
+        sa.ForeignKeyConstraint(['lecture_id'], ['lectures.lecture_id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.user_id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id', 'lecture_id'),
+    )
+
+
+def downgrade():
+    op.drop_table('lecture_user_progress')
+    op.drop_table('lectures')
+    op.drop_table('course_membership')
+    op.drop_table('courses')
+    op.drop_table('users')
+    sa.Enum(name='userrole').drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,41 @@
+"""storage cleanup jobs
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 09:14:05.118734
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # databases created with create_all before migrations were introduced may have the table already
+    if sa.inspect(op.get_bind()).has_table('storage_cleanup_jobs'):
+        return
+    op.create_table(
+        'storage_cleanup_jobs',
+        sa.Column('job_id', sa.String(), nullable=False),
+        sa.Column('idempotency_key', sa.String(), nullable=True),
+        sa.Column('job_prefix', sa.String(), nullable=False),
+        sa.Column('job_status', sa.Enum('pending', 'running', 'succeeded', 'failed', name='jobstatus'), nullable=False),
+        sa.Column('job_attempts', sa.Integer(), nullable=False),
+        sa.Column('last_error', sa.String(), nullable=True),
+        sa.Column('created_by', sa.String(), nullable=True),
+        sa.Column('run_after', sa.DateTime(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['created_by'], ['users.user_id'], ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('job_id'),
+        sa.UniqueConstraint('idempotency_key'),
+    )
+
+
+def downgrade():
+    op.drop_table('storage_cleanup_jobs')
+    sa.Enum(name='jobstatus').drop(op.get_bind(), checkfirst=True)
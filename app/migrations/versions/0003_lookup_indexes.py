@@ -0,0 +1,27 @@
+"""indexes for the hot lookup columns
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 09:31:52.640912
+"""
+from alembic import op
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_course_membership_course_id', 'course_membership', ['course_id'])
+    op.create_index('ix_lectures_course_id_lecture_name', 'lectures', ['course_id', 'lecture_name'])
+    op.create_index('ix_lecture_user_progress_lecture_id', 'lecture_user_progress', ['lecture_id'])
+    op.create_index('ix_storage_cleanup_jobs_status_run_after', 'storage_cleanup_jobs', ['job_status', 'run_after'])
+
+
+def downgrade():
+    op.drop_index('ix_storage_cleanup_jobs_status_run_after', table_name='storage_cleanup_jobs')
+    op.drop_index('ix_lecture_user_progress_lecture_id', table_name='lecture_user_progress')
+    op.drop_index('ix_lectures_course_id_lecture_name', table_name='lectures')
+    op.drop_index('ix_course_membership_course_id', table_name='course_membership')
@@ -0,0 +1,38 @@
+"""course progress counters
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 11:02:17.384590
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'course_user_progress',
+        sa.Column('course_id', sa.String(), nullable=False),
+        sa.Column('user_id', sa.String(), nullable=False),
+        sa.Column('completed_lectures', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['course_id'], ['courses.course_id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.user_id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('course_id', 'user_id'),
+    )
+    # count the progress recorded so far
+    op.execute(
+        "INSERT INTO course_user_progress (course_id, user_id, completed_lectures) "
+        "SELECT lectures.course_id, lecture_user_progress.user_id, "
+        "SUM(CASE WHEN lecture_user_progress.lecture_completed THEN 1 ELSE 0 END) "
+        "FROM lecture_user_progress JOIN lectures ON lectures.lecture_id = lecture_user_progress.lecture_id "
+        "GROUP BY lectures.course_id, lecture_user_progress.user_id"
+    )
+
+
+def downgrade():
+    op.drop_table('course_user_progress')
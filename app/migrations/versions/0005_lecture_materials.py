@@ -0,0 +1,33 @@
+"""lecture material metadata
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 14:20:41.912306
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # filled from the storage with `python -m lecture_materials`, the migration does not reach the storage
+    op.create_table(
+        'lecture_materials',
+        sa.Column('lecture_id', sa.String(), nullable=False),
+        sa.Column('filename', sa.String(), nullable=False),
+        sa.Column('file_size', sa.BigInteger(), nullable=False),
+        sa.Column('content_type', sa.String(), nullable=False),
+        sa.Column('etag', sa.String(), nullable=False),
+        sa.Column('uploaded_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['lecture_id'], ['lectures.lecture_id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('lecture_id', 'filename'),
+    )
+
+
+def downgrade():
+    op.drop_table('lecture_materials')
@@ -1,5 +1,7 @@
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from sqlalchemy import String, Enum, ForeignKey, Boolean
+from sqlalchemy import String, Enum, ForeignKey, Boolean, Integer, BigInteger, DateTime, Index
+from datetime import datetime
+from typing import Optional
 import enum
 
 class UserRole(enum.Enum):
@@ -33,6 +35,11 @@ class CourseMembership(Base):
     user: Mapped[User] = relationship("User", backref="course_membership")
     course: Mapped[Course] = relationship("Course", backref="course_membership")
     
+    __table_args__ = (
+        # the primary key (user_id, course_id) serves lookups by user, members are also listed per course
+        Index('ix_course_membership_course_id', 'course_id'),
+    )
+    
 class Lecture(Base):
     __tablename__ = 'lectures'
     
@@ -42,6 +49,24 @@ class Lecture(Base):
     
     course: Mapped[Course] = relationship("Course", backref="lectures")
     
+    __table_args__ = (
+        # lectures are listed per course, ordered by name
+        Index('ix_lectures_course_id_lecture_name', 'course_id', 'lecture_name'),
+    )
+    
+class LectureMaterial(Base):
+    __tablename__ = 'lecture_materials'
+    
+    # the primary key (lecture_id, filename) serves the listings (ordered by name) and existence checks of a lecture
+    lecture_id: Mapped[str] = mapped_column('lecture_id', String, ForeignKey('lectures.lecture_id', ondelete='CASCADE'), primary_key=True)
+    filename: Mapped[str] = mapped_column('filename', String, primary_key=True)
+    size: Mapped[int] = mapped_column('file_size', BigInteger)
+    content_type: Mapped[str] = mapped_column('content_type', String)
+    etag: Mapped[str] = mapped_column('etag', String)
+    uploaded_at: Mapped[datetime] = mapped_column('uploaded_at', DateTime)
+    
+    lecture: Mapped[Lecture] = relationship("Lecture", backref="lecture_materials")
+    
 class LectureUserProgress(Base):
     __tablename__ = 'lecture_user_progress'
     
@@ -50,4 +75,42 @@ class LectureUserProgress(Base):
     completed: Mapped[bool] = mapped_column('lecture_completed', Boolean)
     
     user: Mapped[User] = relationship("User", backref="lecture_user_progress")
-    lecture: Mapped[Lecture] = relationship("Lecture", backref="lecture_user_progress")
\ No newline at end of file
+    lecture: Mapped[Lecture] = relationship("Lecture", backref="lecture_user_progress")
+    
+    __table_args__ = (
+        # the primary key (user_id, lecture_id) serves lookups by user, progress is also joined and deleted per lecture
+        Index('ix_lecture_user_progress_lecture_id', 'lecture_id'),
+    )
+    
+class CourseUserProgress(Base):
+    __tablename__ = 'course_user_progress'
+    
+    # course_id first, the progress report reads all rows of a course
+    course_id: Mapped[str] = mapped_column('course_id', String, ForeignKey('courses.course_id', ondelete='CASCADE'), primary_key=True)
+    user_id: Mapped[str] = mapped_column('user_id', String, ForeignKey('users.user_id', ondelete='CASCADE'), primary_key=True)
+    completed_lectures: Mapped[int] = mapped_column('completed_lectures', Integer)
+    
+class JobStatus(enum.Enum):
+    pending = "pending"
+    running = "running"
+    succeeded = "succeeded"
+    failed = "failed"
+
+class StorageCleanupJob(Base):
+    __tablename__ = 'storage_cleanup_jobs'
+    
+    id: Mapped[str] = mapped_column('job_id', String, primary_key=True)
+    idempotency_key: Mapped[Optional[str]] = mapped_column('idempotency_key', String, unique=True, nullable=True)
+    prefix: Mapped[str] = mapped_column('job_prefix', String)
+    status: Mapped[JobStatus] = mapped_column('job_status', Enum(JobStatus))
+    attempts: Mapped[int] = mapped_column('job_attempts', Integer, default=0)
+    last_error: Mapped[Optional[str]] = mapped_column('last_error', String, nullable=True)
+    created_by: Mapped[Optional[str]] = mapped_column('created_by', String, ForeignKey('users.user_id', ondelete='SET NULL'), nullable=True)
+    run_after: Mapped[datetime] = mapped_column('run_after', DateTime)
+    created_at: Mapped[datetime] = mapped_column('created_at', DateTime)
+    updated_at: Mapped[datetime] = mapped_column('updated_at', DateTime)
+    
+    __table_args__ = (
+        # workers claim the due pending jobs
+        Index('ix_storage_cleanup_jobs_status_run_after', 'job_status', 'run_after'),
+    )
@@ -0,0 +1,58 @@
+from fastapi import Query
+from typing import Optional
+from sqlalchemy import Select
+from db import read_all, read_scalars
+import dotenv
+import os
+
+dotenv.load_dotenv()
+
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "100"))
+
+
+def pagination_params(
+    cursor: Optional[str] = Query(default=None, description="The next_cursor of the previous page"),
+    limit: Optional[int] = Query(default=None, ge=1, le=PAGE_SIZE_MAX, description="The page size"),
+    name_prefix: Optional[str] = Query(default=None, description="Only return entries whose name starts with this prefix"),
+) -> dict:
+    return {
+        "cursor": cursor,
+        "limit": limit,
+        "name_prefix": name_prefix,
+    }
+
+
+async def paginate_select(session, statement: Select, key_column, name_column, params: dict, default_limit: int, offset: int = 0) -> tuple[list, Optional[str]]:
+    """
+        Applies keyset pagination to a select(): the rows are sorted by the
+        (unique) key column and a page starts after the key given as cursor,
+        so deep pages cost the same as the first one. Runs on the event loop
+        with an AsyncSession and in the thread pool with a sync Session.
+
+        :param offset: Rows to skip after the cursor, only for legacy page numbers
+        :return: The entities (for a select of a single entity) or rows of the page and the cursor of the next page (None on the last page)
+    """
+    limit = params["limit"] or default_limit
+    statement = _page(statement, key_column, name_column, params, limit, offset)
+    read = read_scalars if len(statement.column_descriptions) == 1 else read_all
+    return _split_page(await read(session, statement), limit, key_column)
+
+
+def _page(statement: Select, key_column, name_column, params: dict, limit: int, offset: int = 0) -> Select:
+    if params["name_prefix"]:
+        statement = statement.where(name_column.startswith(params["name_prefix"], autoescape=True))
+    if params["cursor"] is not None:
+        statement = statement.where(key_column > params["cursor"])
+    return statement.order_by(key_column).offset(offset).limit(limit + 1)
+
+
+def _split_page(rows: list, limit: int, key_column) -> tuple[list, Optional[str]]:
+    if len(rows) > limit:
+        return rows[:limit], _key_of(rows[limit - 1], key_column)
+    return rows, None
+
+
+def _key_of(row, key_column) -> str:
+    # rows of multi-entity queries are tuples with the keyed entity first
+    entity = row[0] if hasattr(row, "_fields") else row
+    return getattr(entity, key_column.key)
@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional
+import hashlib
+import os
+import time
+import dotenv
+
+dotenv.load_dotenv()
+
+_MAX_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "300"))
+
+
+class PrincipalCache:
+    """
+        Bounded LRU cache of verified principals keyed by the hash of the bearer
+        token. Entries are only stored after the token signature was verified
+        and the user was found, so a hit can skip both steps.
+
+        The cache lives in one worker process. Routes that change a user's
+        role or remove a user call invalidate_user, which only reaches the
+        worker handling that request; in the other workers the TTL
+        (PRINCIPAL_CACHE_TTL) is the only bound on how long the old principal
+        is served. Course memberships are not cached.
+    """
+
+    def __init__(self, max_size: int = _MAX_SIZE, ttl: float = _TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = Lock()
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> Optional[dict]:
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, token: str, user: dict, expires_at: Optional[float] = None) -> None:
+        """
+            :param expires_at: The unix timestamp of the token's exp claim, if any.
+                The entry never outlives the token.
+        """
+        ttl = self.ttl
+        if expires_at is not None:
+            ttl = min(ttl, expires_at - time.time())
+        if ttl <= 0 or self.max_size <= 0:
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, user)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: str) -> None:
+        with self._lock:
+            for key in [key for key, (_, user) in self._entries.items() if user["id"] == user_id]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+principal_cache = PrincipalCache()
@@ -0,0 +1,48 @@
+from typing import Optional
+from sqlalchemy import select, func
+from db import dialect_insert
+import models
+
+
+def refresh_course_progress(session, course_id: str, user_id: Optional[str] = None) -> None:
+    """
+        Recounts the completed lectures of the course for one user, or for all
+        users, and stores them in course_user_progress. Runs in the caller's
+        transaction, so call it after changing the progress or the lectures and
+        before committing.
+    """
+    query = select(
+        models.LectureUserProgress.user_id,
+        models.Lecture.course_id,
+        func.count().filter(models.LectureUserProgress.completed.is_(True)),
+    ).join(models.Lecture, models.Lecture.id == models.LectureUserProgress.lecture_id).where(
+        models.Lecture.course_id == course_id).group_by(models.LectureUserProgress.user_id, models.Lecture.course_id)
+    if user_id is None:
+        # users without any progress left (e.g. after deleting their only lecture) would keep a stale row
+        delete_course_progress(session, course_id)
+    else:
+        query = query.where(models.LectureUserProgress.user_id == user_id)
+        _lock_course_progress(session, course_id, user_id)
+    insert = dialect_insert(session, models.CourseUserProgress).from_select(
+        [models.CourseUserProgress.user_id, models.CourseUserProgress.course_id, models.CourseUserProgress.completed_lectures], query)
+    session.execute(insert.on_conflict_do_update(
+        index_elements=[models.CourseUserProgress.course_id, models.CourseUserProgress.user_id],
+        set_={"completed_lectures": insert.excluded.completed_lectures},
+    ))
+
+
+def _lock_course_progress(session, course_id: str, user_id: str) -> None:
+    """
+        Locks the counter row of the user until the end of the transaction.
+        Under READ COMMITTED a recount only sees committed progress, so two
+        concurrent writes of the same user would each miss the other's row;
+        with the lock the later one waits and recounts after the first commits.
+    """
+    session.execute(dialect_insert(session, models.CourseUserProgress).values(
+        course_id=course_id, user_id=user_id, completed_lectures=0).on_conflict_do_nothing())
+    session.execute(select(models.CourseUserProgress.user_id).where(
+        models.CourseUserProgress.course_id == course_id, models.CourseUserProgress.user_id == user_id).with_for_update())
+
+
+def delete_course_progress(session, course_id: str) -> None:
+    session.query(models.CourseUserProgress).filter(models.CourseUserProgress.course_id == course_id).delete()
@@ -0,0 +1,40 @@
+from slowapi import Limiter
+from slowapi.util import get_remote_address
+from starlette.requests import Request
+import dotenv
+import jwt
+import os
+
+dotenv.load_dotenv()
+
+# e.g. redis://redis:6379/0 in production; memory:// keeps the counters in this process (tests, local runs)
+RATE_LIMIT_STORAGE_URI = os.getenv("RATE_LIMIT_STORAGE_URI", "memory://")
+RATE_LIMIT_DEFAULT = os.getenv("RATE_LIMIT_DEFAULT", "10/minute")
+
+
+def get_rate_limit_key(request: Request) -> str:
+    """
+        Rate limits authenticated requests per user (the verified `sub` of the
+        bearer token), so all workers and replicas share one budget per user.
+        Anonymous requests and invalid tokens are limited per client address.
+    """
+    authorization = request.headers.get("authorization")
+    if authorization is not None:
+        parts = authorization.split(" ")
+        try:
+            return "user:" + str(jwt.decode(parts[1], "secret", algorithms=["HS256"])["sub"])
+        except Exception:
+            pass
+    return "ip:" + get_remote_address(request)
+
+
+limiter = Limiter(
+    key_func=get_rate_limit_key,
+    default_limits=[RATE_LIMIT_DEFAULT],
+    storage_uri=RATE_LIMIT_STORAGE_URI,
+    # sliding window, evaluated atomically by a Lua script on Redis
+    strategy="moving-window",
+    key_prefix="rate_limit",
+    # keep limiting per process while Redis is unreachable
+    in_memory_fallback_enabled=not RATE_LIMIT_STORAGE_URI.startswith("memory://"),
+)
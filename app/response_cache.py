@@ -0,0 +1,288 @@
+from collections import OrderedDict
+from functools import partial
+from typing import Callable, Optional, Tuple
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends import Backend
+from fastapi_cache.decorator import cache
+from starlette.requests import Request
+from loguru import logger
+import anyio.from_thread
+import asyncio
+import hashlib
+import dotenv
+import time
+import os
+
+dotenv.load_dotenv()
+
+# memory:// keeps the cache in this process only (tests, local runs), redis://... adds a shared tier
+CACHE_BACKEND_URL = os.getenv("CACHE_BACKEND_URL", "memory://")
+_CACHE_PREFIX = "api-cache"
+_L1_MAX_ENTRIES = int(os.getenv("CACHE_L1_MAX_ENTRIES", "10000"))
+# entries copied from the shared tier are kept in the process for at most this many seconds,
+# which bounds how long another worker's invalidation can go unnoticed
+_L1_TTL = int(os.getenv("CACHE_L1_TTL", "5"))
+# tag sets outlive the entries they list, so that no entry survives an invalidation
+_TAG_TTL = int(os.getenv("CACHE_TAG_TTL", "3600"))
+
+
+class LRUBackend(Backend):
+    """
+        In-process backend with a bounded number of entries. The least recently
+        used entries are evicted first.
+    """
+
+    def __init__(self, max_entries: int = _L1_MAX_ENTRIES, max_ttl: Optional[int] = None):
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self._store: OrderedDict[str, tuple[float, str]] = OrderedDict()
+
+    def _get(self, key: str) -> Optional[tuple[float, str]]:
+        entry = self._store.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._store[key]
+            return None
+        self._store.move_to_end(key)
+        return entry
+
+    async def get_with_ttl(self, key: str) -> Tuple[int, Optional[str]]:
+        entry = self._get(key)
+        if entry is None:
+            return 0, None
+        return int(entry[0] - time.monotonic()), entry[1]
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._get(key)
+        return entry[1] if entry is not None else None
+
+    async def set(self, key: str, value: str, expire: Optional[int] = None) -> None:
+        ttl = expire or 0
+        if self.max_ttl is not None:
+            ttl = min(ttl, self.max_ttl)
+        self._store[key] = (time.monotonic() + ttl, value)
+        self._store.move_to_end(key)
+        while len(self._store) > self.max_entries:
+            self._store.popitem(last=False)
+
+    async def clear(self, namespace: Optional[str] = None, key: Optional[str] = None) -> int:
+        if namespace:
+            keys = [cached_key for cached_key in self._store if cached_key == namespace or cached_key.startswith(namespace + ":")]
+        else:
+            keys = [key] if key in self._store else []
+        for cached_key in keys:
+            del self._store[cached_key]
+        return len(keys)
+
+
+class TieredBackend(Backend):
+    """
+        Looks up the process-local tier (L1) first and falls back to the shared
+        tier (L2), copying hits into L1. Writes and invalidations go to both.
+    """
+
+    def __init__(self, l1: Backend, l2: Backend):
+        self.l1 = l1
+        self.l2 = l2
+
+    async def get_with_ttl(self, key: str) -> Tuple[int, Optional[str]]:
+        ttl, value = await self.l1.get_with_ttl(key)
+        if value is not None:
+            return ttl, value
+        ttl, value = await self.l2.get_with_ttl(key)
+        if value is not None and ttl > 0:
+            await self.l1.set(key, value, ttl)
+        return ttl, value
+
+    async def get(self, key: str) -> Optional[str]:
+        return (await self.get_with_ttl(key))[1]
+
+    async def set(self, key: str, value: str, expire: Optional[int] = None) -> None:
+        await self.l2.set(key, value, expire)
+        await self.l1.set(key, value, expire)
+
+    async def clear(self, namespace: Optional[str] = None, key: Optional[str] = None) -> int:
+        count = await self.l2.clear(namespace, key)
+        await self.l1.clear(namespace, key)
+        return count
+
+
+class CountingBackend(Backend):
+    """
+        Counts hits and misses per cached route. Relies on the key layout of
+        _course_key_builder, whose second to last segment is the route name.
+    """
+
+    def __init__(self, backend: Backend):
+        self.backend = backend
+        self.stats: dict[str, dict[str, int]] = {}
+
+    def _count(self, key: str, hit: bool) -> None:
+        segments = key.rsplit(":", 2)
+        route = segments[1] if len(segments) == 3 else "unknown"
+        stats = self.stats.setdefault(route, {"hits": 0, "misses": 0})
+        stats["hits" if hit else "misses"] += 1
+
+    async def get_with_ttl(self, key: str) -> Tuple[int, Optional[str]]:
+        ttl, value = await self.backend.get_with_ttl(key)
+        self._count(key, value is not None)
+        return ttl, value
+
+    async def get(self, key: str) -> Optional[str]:
+        value = await self.backend.get(key)
+        self._count(key, value is not None)
+        return value
+
+    async def set(self, key: str, value: str, expire: Optional[int] = None) -> None:
+        await self.backend.set(key, value, expire)
+
+    async def clear(self, namespace: Optional[str] = None, key: Optional[str] = None) -> int:
+        return await self.backend.clear(namespace, key)
+
+
+class TaggedRedisBackend(Backend):
+    """
+        Redis backend that records every key in a set per namespace it can be
+        cleared by (see _cache_tags), so clearing a namespace only touches its
+        own keys. fastapi-cache's RedisBackend scans the whole database with
+        KEYS instead, which blocks Redis on every invalidation.
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    @staticmethod
+    def _tag_key(namespace: str) -> str:
+        return f"tag:{namespace}"
+
+    async def get_with_ttl(self, key: str) -> Tuple[int, Optional[str]]:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            return await pipe.ttl(key).get(key).execute()
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self.redis.get(key)
+
+    async def set(self, key: str, value: str, expire: Optional[int] = None) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(key, value, ex=expire)
+            for tag in _cache_tags(key):
+                pipe.sadd(self._tag_key(tag), key)
+                pipe.expire(self._tag_key(tag), max(expire or 0, _TAG_TTL))
+            await pipe.execute()
+
+    async def clear(self, namespace: Optional[str] = None, key: Optional[str] = None) -> int:
+        """
+            Deletes the keys of a namespace returned by _cache_tags, or a
+            single key. Keys are removed from their other tag sets when those
+            are cleared or expire.
+        """
+        if namespace:
+            tag_key = self._tag_key(namespace)
+            async with self.redis.pipeline(transaction=True) as pipe:
+                keys, _ = await pipe.smembers(tag_key).delete(tag_key).execute()
+            return await self.redis.delete(*keys) if keys else 0
+        elif key:
+            return await self.redis.delete(key)
+        return 0
+
+
+def create_backend(url: str = CACHE_BACKEND_URL) -> Backend:
+    if url.startswith("memory://"):
+        return CountingBackend(LRUBackend())
+    from redis import asyncio as aioredis
+    return CountingBackend(TieredBackend(LRUBackend(max_ttl=_L1_TTL), TaggedRedisBackend(aioredis.from_url(url))))
+
+
+def init_cache() -> None:
+    FastAPICache.init(create_backend(), prefix=_CACHE_PREFIX)
+
+
+def get_cache_stats() -> dict[str, dict[str, int]]:
+    backend = FastAPICache.get_backend()
+    return backend.stats if isinstance(backend, CountingBackend) else {}
+
+
+def _course_tag(course_id: str, scope: Optional[str] = None) -> str:
+    return f"course:{course_id}" + (f":{scope}" if scope is not None else "")
+
+
+def _cache_tags(key: str) -> list[str]:
+    """
+        Returns the namespaces invalidate_course can clear a key built by
+        _course_key_builder with: the course, and the user or lecture scope of
+        the key within the course.
+    """
+    prefix, separator, rest = key.partition(":course:")
+    if not separator:
+        return []
+    segments = rest.split(":")
+    tags = [f"{prefix}:{_course_tag(segments[0])}"]
+    if len(segments) > 2 and segments[1] in ("user", "lecture"):
+        tags.append(f"{prefix}:{_course_tag(segments[0], f'{segments[1]}:{segments[2]}')}")
+    return tags
+
+
+def _course_key_builder(func: Callable, namespace: Optional[str] = "", request: Optional[Request] = None, response=None, args=None, kwargs=None, per_user: bool = False) -> str:
+    if per_user:
+        scope = f"user:{kwargs['user']['id']}"
+    elif "lecture_id" in kwargs:
+        scope = f"lecture:{kwargs['lecture_id']}"
+    else:
+        scope = "all"
+    query = hashlib.md5(str(sorted(request.query_params.multi_items())).encode()).hexdigest() if request is not None else ""
+    return f"{FastAPICache.get_prefix()}:{_course_tag(kwargs['course_id'], scope)}:{func.__module__}.{func.__name__}:{query}"
+
+
+def course_cache(expire: int, per_user: bool = False):
+    """
+        Caches a route below the course of its path so that write routes can
+        invalidate it with invalidate_course. The cache key only depends on the
+        course id, the lecture id (if the route has one) and the query
+        parameters, and on the current user if the response is user specific
+        (per_user=True, requires a `user` parameter). Other arguments, like the
+        results of authorization dependencies, are not part of the key, and
+        these dependencies still run on every request.
+    """
+    return cache(expire=expire, key_builder=partial(_course_key_builder, per_user=per_user))
+
+
+def _invalidation_namespace(course_id: str, user_id: Optional[str], lecture_id: Optional[str]) -> str:
+    if user_id is not None:
+        return _course_tag(course_id, f"user:{user_id}")
+    if lecture_id is not None:
+        return _course_tag(course_id, f"lecture:{lecture_id}")
+    return _course_tag(course_id)
+
+
+async def invalidate_course_async(course_id: str, user_id: Optional[str] = None, lecture_id: Optional[str] = None) -> None:
+    """
+        Drops the cached responses of a course, or only those of one user or
+        one lecture in the course. For async routes and other code on the
+        event loop.
+
+        :raises Exception: If the cache backend fails, the cached responses may be stale until they expire
+    """
+    namespace = _invalidation_namespace(course_id, user_id, lecture_id)
+    try:
+        await FastAPICache.clear(namespace)
+    except Exception as e:
+        logger.error(f"Could not invalidate cache for {namespace}: {e!r}")
+        raise
+
+
+def invalidate_course(course_id: str, user_id: Optional[str] = None, lecture_id: Optional[str] = None) -> None:
+    """
+        Like invalidate_course_async, for sync routes and other code in a
+        worker thread of the event loop (e.g. run_in_threadpool). It blocks
+        until the cache is cleared.
+
+        :raises RuntimeError: If called on the event loop or in a thread that was not started by it
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        # no event loop in this thread, anyio hands the call to the loop of the worker thread
+        anyio.from_thread.run(invalidate_course_async, course_id, user_id, lecture_id)
+        return
+    raise RuntimeError("invalidate_course would block the event loop, use invalidate_course_async")
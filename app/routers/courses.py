@@ -1,10 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header, Response, Query, Request
+from starlette.concurrency import run_in_threadpool
 import models
 import schemas
 from dependencies import *
+from db import dialect_insert, read_all
+from sqlalchemy import select, func
+from collections import deque
+import codecs
+import csv
 import uuid
-from typing import Annotated
-from storage import list_files, delete_file
+from typing import Annotated, Optional
+from jobs import enqueue_storage_cleanup, find_storage_cleanup, commit_storage_cleanup, IdempotencyKeyConflict
+from response_cache import course_cache, invalidate_course, invalidate_course_async
+from pagination import pagination_params, paginate_select
+from progress import delete_course_progress
+from lecture_materials import delete_lecture_materials
 from loguru import logger
 
 router = APIRouter(
@@ -73,32 +83,183 @@ def add_user_to_course(course_id: str, is_instructor: Annotated[bool, Depends(is
         is_instructor=new_user.is_instructor,
     ))
     session.commit()
+    invalidate_course(course_id)
     logger.info(f"Added user {new_user.user_id} to course {course_id}")
 
 
-@router.delete(
-    "/{course_id}",
-    status_code=204,
+# keeps the IN lists and multi-row INSERTs below the bind parameter limits of the databases
+_BULK_CHUNK_SIZE = 500
+
+
+def _bulk_add_users_to_course(session, course_id: str, entries: list[schemas.AddUserToCourseRequest]) -> tuple[list[dict], int]:
+    # a user listed more than once is added with the first entry
+    requested = {}
+    for entry in entries:
+        requested.setdefault(entry.user_id, entry.is_instructor)
+    user_ids = list(requested)
+    roles = {}
+    for i in range(0, len(user_ids), _BULK_CHUNK_SIZE):
+        roles.update(session.query(models.User.id, models.User.role).filter(models.User.id.in_(user_ids[i:i + _BULK_CHUNK_SIZE])).all())
+
+    statuses = {}
+    memberships = []
+    for user_id, is_instructor in requested.items():
+        if user_id not in roles:
+            statuses[user_id] = schemas.BulkEnrollmentStatus.user_not_found
+        elif is_instructor and roles[user_id] == models.UserRole.student:
+            statuses[user_id] = schemas.BulkEnrollmentStatus.forbidden
+        else:
+            memberships.append({"user_id": user_id, "course_id": course_id, "is_instructor": is_instructor})
+
+    # existing memberships are left untouched, RETURNING tells which rows are new
+    added = set()
+    for i in range(0, len(memberships), _BULK_CHUNK_SIZE):
+        added.update(session.scalars(dialect_insert(session, models.CourseMembership).values(memberships[i:i + _BULK_CHUNK_SIZE])
+                                     .on_conflict_do_nothing().returning(models.CourseMembership.user_id)))
+    session.commit()
+    for membership in memberships:
+        statuses[membership["user_id"]] = schemas.BulkEnrollmentStatus.added if membership["user_id"] in added else schemas.BulkEnrollmentStatus.already_member
+    logger.info(f"Added {len(added)} of {len(requested)} users to course {course_id}")
+    # the caller invalidates the cached course if users were added
+    return [{"user_id": user_id, "status": statuses[user_id]} for user_id in user_ids], len(added)
+
+
+class _LineFeed:
+    """
+        Iterator over the lines queued so far, so that a single csv.reader can
+        parse a body that arrives in chunks. The reader must only be advanced
+        when a whole record is queued, it ends at the end of the queue.
+    """
+
+    def __init__(self):
+        self.lines = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+
+async def _read_csv_rows(request: Request):
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    feed = _LineFeed()
+    reader = csv.reader(feed)
+    buffer = ""
+    # quoted fields may contain line breaks, a record ends at a line break after an even number of quotes
+    in_quotes = False
+    async for chunk in request.stream():
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            feed.lines.append(line + "\n")
+            in_quotes ^= line.count('"') % 2 == 1
+            if not in_quotes:
+                yield next(reader)
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        feed.lines.append(buffer)
+    for row in reader:
+        yield row
+
+
+@router.post(
+    "/{course_id}/users/bulk",
+    response_model=schemas.BulkAddUsersToCourseResponse,
     dependencies=[Depends(check_if_course_exists)],
     tags=["courses"],
-    summary='Delete a course',
-    description='Delete a course. Only admins and course instructors can access this endpoint.',
+    summary='Add many users to a course',
+    description=f'Add up to {schemas.BULK_ENROLLMENT_MAX_USERS} users to a course in one transaction. Returns the result for every user: users that are already members are left unchanged, students cannot be added as instructors. Only admins and course instructors can access this endpoint.',
     responses={
         403: {"description": "Forbidden"}
     }
 )
-def delete_course(course_id: str, is_instructor: Annotated[bool, Depends(is_course_instructor)], session=Depends(get_session), user=Depends(decode_token)):
+def add_users_to_course(course_id: str, is_instructor: Annotated[bool, Depends(is_course_instructor)], body: schemas.BulkAddUsersToCourseRequest, session=Depends(get_session), user=Depends(decode_token)):
     if not is_instructor and not user["role"] == models.UserRole.admin:
         raise HTTPException(status_code=403, detail="Forbidden")
-    session.query(models.Course).filter(models.Course.id == course_id).delete()
-    session.query(models.Lecture).filter(
-        models.Lecture.course_id == course_id).delete()
-    session.commit()
-    files_in_course = list_files(f'{course_id}/')
-    for file in files_in_course:
-        logger.trace(f"Cleaning file {file} for course {course_id}")
-        delete_file(file)
-    logger.info(f"Deleted course {course_id}")
+    results, added = _bulk_add_users_to_course(session, course_id, body.users)
+    if added:
+        invalidate_course(course_id)
+    return {
+        "data": results
+    }
+
+
+@router.post(
+    "/{course_id}/users/bulk/csv",
+    response_model=schemas.BulkAddUsersToCourseResponse,
+    dependencies=[Depends(check_if_course_exists)],
+    tags=["courses"],
+    summary='Add many users to a course from a CSV file',
+    description='Same as POST /courses/{course_id}/users/bulk, but the request body is a CSV file (text/csv) with the columns user_id and optionally is_instructor (true/false). A header row is optional. Only admins and course instructors can access this endpoint.',
+    responses={
+        403: {"description": "Forbidden"},
+        413: {"description": "Too many users"},
+        422: {"description": "Invalid CSV row"}
+    }
+)
+async def add_users_to_course_from_csv(course_id: str, request: Request, is_instructor: Annotated[bool, Depends(is_course_instructor)], session=Depends(get_session), user=Depends(decode_token)):
+    if not is_instructor and not user["role"] == models.UserRole.admin:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    entries = []
+    line = 0
+    async for row in _read_csv_rows(request):
+        line += 1
+        if not row or not row[0].strip() or (line == 1 and row[0].strip() == "user_id"):
+            continue
+        instructor = row[1].strip().lower() if len(row) > 1 and row[1].strip() else "false"
+        if instructor not in ["true", "false"]:
+            raise HTTPException(status_code=422, detail=f"Invalid is_instructor value in line {line}")
+        if len(entries) >= schemas.BULK_ENROLLMENT_MAX_USERS:
+            raise HTTPException(status_code=413, detail=f"At most {schemas.BULK_ENROLLMENT_MAX_USERS} users can be added at once")
+        entries.append(schemas.AddUserToCourseRequest(user_id=row[0].strip(), is_instructor=instructor == "true"))
+    results, added = await run_in_threadpool(_bulk_add_users_to_course, session, course_id, entries)
+    if added:
+        await invalidate_course_async(course_id)
+    return {
+        "data": results
+    }
+
+
+@router.delete(
+    "/{course_id}",
+    status_code=204,
+    tags=["courses"],
+    summary='Delete a course',
+    description='Delete a course. Only admins and course instructors can access this endpoint. The uploaded materials are deleted in the background, the Location header points to the cleanup job. A retry with the same Idempotency-Key returns the job of the first attempt, even though the course is gone by then.',
+    responses={
+        403: {"description": "Forbidden"},
+        404: {"description": "Course not found"},
+        409: {"description": "The Idempotency-Key was used for another request"}
+    }
+)
+def delete_course(course_id: str, response: Response, is_instructor: Annotated[bool, Depends(is_course_instructor)], context=Depends(get_request_context), session=Depends(get_session), user=Depends(decode_token), idempotency_key: Optional[str] = Header(default=None)):
+    prefix = f'{course_id}/'
+    try:
+        job = find_storage_cleanup(session, idempotency_key, user["id"], prefix)
+    except IdempotencyKeyConflict:
+        raise HTTPException(status_code=409, detail="Idempotency-Key was used for another request")
+    if job is None:
+        # the existence check runs after the replay check, a retry finds the course deleted
+        if not context["course_exists"]:
+            raise HTTPException(status_code=404, detail="Course not found")
+        if not is_instructor and not user["role"] == models.UserRole.admin:
+            raise HTTPException(status_code=403, detail="Forbidden")
+        delete_lecture_materials(session, course_id)
+        session.query(models.Course).filter(models.Course.id == course_id).delete()
+        session.query(models.Lecture).filter(
+            models.Lecture.course_id == course_id).delete()
+        delete_course_progress(session, course_id)
+        job = enqueue_storage_cleanup(session, prefix, user["id"], idempotency_key)
+        try:
+            job = commit_storage_cleanup(session, job)
+        except IdempotencyKeyConflict:
+            raise HTTPException(status_code=409, detail="Idempotency-Key was used for another request")
+        invalidate_course(course_id)
+        logger.info(f"Deleted course {course_id}")
+    response.headers["Location"] = f"/jobs/{job.id}"
         
 
 @router.delete(
@@ -122,6 +283,7 @@ def remove_user_from_course(course_id: str, user_id: str, is_instructor: Annotat
     except NoResultFound:
         raise HTTPException(status_code=404, detail="User not found")
     session.commit()
+    invalidate_course(course_id)
     logger.info(f"Removed user {user_id} from course {course_id}")
     
 
@@ -131,13 +293,15 @@ def remove_user_from_course(course_id: str, user_id: str, is_instructor: Annotat
     dependencies=[Depends(check_if_course_exists)],
     tags=["courses"],
     summary='Get all users in a course',
-    description='Get all users in a course.',
+    description='Get all users in a course, sorted by id and paginated (50 per page by default). Pass the returned next_cursor as cursor to get the next page. The list is cached for 30 seconds.',
     responses={
         404: {"description": "Course not found"}
     }
 )
-def get_course_users(course_id: str, session=Depends(get_session)):
-    res = session.query(models.User, models.CourseMembership).join(models.CourseMembership, models.CourseMembership.user_id == models.User.id).filter(models.CourseMembership.course_id == course_id).all()
+@course_cache(expire=30)
+async def get_course_users(course_id: str, session=Depends(get_read_session), pagination=Depends(pagination_params)):
+    query = select(models.User, models.CourseMembership).join(models.CourseMembership, models.CourseMembership.user_id == models.User.id).where(models.CourseMembership.course_id == course_id)
+    res, next_cursor = await paginate_select(session, query, models.User.id, models.User.name, pagination, default_limit=50)
     return {
         "data": [{
             "id": user.id,
@@ -145,24 +309,63 @@ def get_course_users(course_id: str, session=Depends(get_session)):
             "role": user.role,
             "is_instructor": course_membership.is_instructor
         } for user, course_membership in res
-        ]
+        ],
+        "next_cursor": next_cursor
+    }
+    
+@router.get(
+    "/{course_id}/progress",
+    response_model=schemas.GetCourseProgressResponse,
+    dependencies=[Depends(check_if_course_exists)],
+    tags=["courses"],
+    summary='Get the progress of the students in a course',
+    description='Get the number and ratio of completed lectures for every student (member who is not an instructor) of a course, sorted by id and paginated (50 per page by default). Pass the returned next_cursor as cursor to get the next page. Only admins and course instructors can access this endpoint.',
+    responses={
+        403: {"description": "Forbidden"},
+        404: {"description": "Course not found"}
+    }
+)
+async def get_course_progress(course_id: str, is_instructor: Annotated[bool, Depends(is_course_instructor)], session=Depends(get_read_session), user=Depends(decode_token), pagination=Depends(pagination_params)):
+    if not is_instructor and not user["role"] == models.UserRole.admin:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    lectures = (await read_all(session, select(func.count()).select_from(models.Lecture).where(models.Lecture.course_id == course_id)))[0][0]
+    # the counters are kept up to date by the lecture routes, so this reads one row per student
+    query = select(models.User, models.CourseUserProgress.completed_lectures).join(
+        models.CourseMembership, models.CourseMembership.user_id == models.User.id).outerjoin(
+        models.CourseUserProgress, (models.CourseUserProgress.course_id == course_id) & (models.CourseUserProgress.user_id == models.User.id)).where(
+        models.CourseMembership.course_id == course_id, models.CourseMembership.is_instructor.is_(False))
+    res, next_cursor = await paginate_select(session, query, models.User.id, models.User.name, pagination, default_limit=50)
+    return {
+        "lectures": lectures,
+        "data": [{
+            "id": student.id,
+            "name": student.name,
+            "role": student.role,
+            "completed_lectures": completed or 0,
+            "completion_ratio": (completed or 0) / lectures if lectures else 0.0
+        } for student, completed in res],
+        "next_cursor": next_cursor
     }
     
 @router.get(
     "/",
     tags=["courses"],
     summary='Get all courses',
-    description='Get all courses in the system. Only teachers and admins can access this endpoint.',
+    description='Get all courses in the system, sorted by id and paginated (10 per page by default). Pass the returned next_cursor as cursor to get the next page. Only teachers and admins can access this endpoint.',
     responses={
         403: {"description": "Forbidden"}
     },
     response_model=schemas.GetCoursesResponse
 )
-def get_courses(session=Depends(get_session), page: int = 1, user=Depends(decode_token)):
+async def get_courses(session=Depends(get_read_session), user=Depends(decode_token), pagination=Depends(pagination_params), page: Optional[int] = Query(default=None, ge=1, deprecated=True, description="Use cursor instead")):
     if user["role"] not in [models.UserRole.admin, models.UserRole.teacher]:
         raise HTTPException(status_code=403, detail="Only teachers and admins can list all courses")
+    # page numbers are kept for old clients, they are translated to an offset
+    offset = (page - 1) * (pagination["limit"] or 10) if page is not None and pagination["cursor"] is None else 0
+    courses, next_cursor = await paginate_select(session, select(models.Course), models.Course.id, models.Course.name, pagination, default_limit=10, offset=offset)
     return {
-        "data": session.query(models.Course).limit(10).offset((page - 1) * 10).all()
+        "data": courses,
+        "next_cursor": next_cursor
     }
     
 @router.get(
@@ -171,14 +374,57 @@ def get_courses(session=Depends(get_session), page: int = 1, user=Depends(decode
     dependencies=[Depends(check_if_course_exists)],
     tags=["courses"],
     summary='Get a course',
-    description='Get a course by id.',
+    description='Get a course by id. The course is cached for 60 seconds.',
     responses={
         404: {"description": "Course not found"}
     }
 )
-def get_course(course_id: str, session=Depends(get_session)):
+@course_cache(expire=60)
+async def get_course(course_id: str, session=Depends(get_read_session)):
+    course = (await read_all(session, select(models.Course).where(models.Course.id == course_id)))[0][0]
+    return {
+        "data": {
+            "id": course.id,
+            "name": course.name
+        }
+    }
+    
+@router.get(
+    "/{course_id}/overview",
+    response_model=schemas.GetCourseOverviewResponse,
+    dependencies=[Depends(check_if_course_exists),
+                  Depends(check_if_course_member)],
+    tags=["courses"],
+    summary='Get a course with its lectures and materials',
+    description='Get a course with all its lectures sorted by name, the status of each lecture for the currently authenticated user and the names of the files uploaded for each lecture. Only course members and admins can access this endpoint.',
+    responses={
+        403: {"description": "Forbidden"},
+        404: {"description": "Course not found"}
+    }
+)
+async def get_course_overview(course_id: str, session=Depends(get_read_session), user=Depends(decode_token)):
+    # one row per lecture (or a single row without lecture), each carrying the course
+    rows = await read_all(session, select(models.Course, models.Lecture, models.LectureUserProgress.completed).outerjoin(
+        models.Lecture, models.Lecture.course_id == models.Course.id).outerjoin(
+        models.LectureUserProgress, (models.LectureUserProgress.lecture_id == models.Lecture.id) & (models.LectureUserProgress.user_id == user["id"])).where(
+        models.Course.id == course_id).order_by(models.Lecture.name))
+    materials = {}
+    for lecture_id, filename in await read_all(session, select(models.LectureMaterial.lecture_id, models.LectureMaterial.filename).join(
+            models.Lecture, models.Lecture.id == models.LectureMaterial.lecture_id).where(
+            models.Lecture.course_id == course_id).order_by(models.LectureMaterial.lecture_id, models.LectureMaterial.filename)):
+        materials.setdefault(lecture_id, []).append(filename)
+    course = rows[0][0]
     return {
-        "data": session.query(models.Course).filter(models.Course.id == course_id).one()
+        "data": {
+            "id": course.id,
+            "name": course.name,
+            "lectures": [{
+                "id": lecture.id,
+                "name": lecture.name,
+                "completed": completed if completed is not None else False,
+                "materials": materials.get(lecture.id, [])
+            } for _, lecture, completed in rows if lecture is not None]
+        }
     }
     
 @router.put(
@@ -205,4 +451,5 @@ def update_user_instrucor_status(course_id: str, user_id: str, body: schemas.Upd
     if body.is_instructor and new_user_role == models.UserRole.student:
         raise HTTPException(status_code=403, detail="Only admins and teachers can add instructors to courses")
     session.commit()
+    invalidate_course(course_id)
     logger.info(f"Updated users {user_id} instructor status in course {course_id} to {is_instructor}")
\ No newline at end of file
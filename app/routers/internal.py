@@ -0,0 +1,30 @@
+from fastapi import APIRouter, Depends, HTTPException
+import models
+from dependencies import decode_token
+from principal_cache import principal_cache
+from db import get_pool_stats, get_async_pool_stats
+from response_cache import get_cache_stats
+
+router = APIRouter(
+    prefix="/internal",
+    tags=["internal"],
+)
+
+
+@router.get(
+    "/stats",
+    summary="Get internal runtime statistics",
+    description="Get statistics of the database connection pools (async_database_pool is null unless DATABASE_ASYNC is set) and the in-process caches of this worker. Only admins can access this endpoint.",
+    responses={
+        403: {"description": "Forbidden"}
+    }
+)
+async def get_stats(user=Depends(decode_token)):
+    if user["role"] is not models.UserRole.admin:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return {
+        "database_pool": get_pool_stats(),
+        "async_database_pool": get_async_pool_stats(),
+        "principal_cache": principal_cache.stats(),
+        "response_cache": get_cache_stats(),
+    }
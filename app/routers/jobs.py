@@ -0,0 +1,31 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select
+import models
+import schemas
+from db import read_scalars
+from dependencies import get_read_session, decode_token
+
+router = APIRouter(
+    prefix="/jobs",
+    tags=["jobs"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+@router.get(
+    "/{job_id}",
+    response_model=schemas.Job,
+    summary="Get the status of a background job",
+    description="Get the status of a background job, e.g. the storage cleanup after deleting a course or lecture. Only admins and the user who started the job can access this endpoint.",
+    responses={
+        403: {"description": "Forbidden"}
+    }
+)
+async def get_job(job_id: str, session=Depends(get_read_session), user=Depends(decode_token)):
+    jobs = await read_scalars(session, select(models.StorageCleanupJob).where(models.StorageCleanupJob.id == job_id))
+    if not jobs:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job = jobs[0]
+    if job.created_by != user["id"] and user["role"] is not models.UserRole.admin:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return job
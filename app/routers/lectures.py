@@ -1,9 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header, Response
+from typing import Optional
 import models
 import uuid
 from dependencies import *
+from db import dialect_insert, read_all
+from sqlalchemy import select
+from progress import refresh_course_progress
 import schemas
-from storage import list_files, delete_file
+from jobs import enqueue_storage_cleanup, find_storage_cleanup, commit_storage_cleanup, IdempotencyKeyConflict
+from lecture_materials import delete_lecture_materials
+from response_cache import course_cache, invalidate_course
 from loguru import logger
 
 router = APIRouter(
@@ -13,19 +19,39 @@ router = APIRouter(
 )
 
 
+def _upsert_lecture_statuses(session, user_id: str, statuses: dict[str, bool]) -> dict[str, bool]:
+    """
+        Inserts or updates the progress of the user for all given lectures in
+        a single statement, without reading the current rows first.
+
+        :param statuses: The completed flag by lecture id
+        :return: The stored completed flag by lecture id
+    """
+    if not statuses:
+        return {}
+    insert = dialect_insert(session, models.LectureUserProgress).values([
+        {"user_id": user_id, "lecture_id": lecture_id, "completed": completed} for lecture_id, completed in statuses.items()
+    ])
+    insert = insert.on_conflict_do_update(
+        index_elements=[models.LectureUserProgress.user_id, models.LectureUserProgress.lecture_id],
+        set_={"lecture_completed": insert.excluded.lecture_completed},
+    ).returning(models.LectureUserProgress.lecture_id, models.LectureUserProgress.completed)
+    return dict(session.execute(insert).all())
+
+
 @router.get(
     "/",
-    dependencies=[Depends(check_if_course_exists)],
+    dependencies=[Depends(check_if_course_exists),
+                  Depends(check_if_course_member)],
     tags=["lectures"],
     summary="Lists all lectures in a course",
-    description="Lists all lectures in a course. Only members of the course and admins can access this endpoint.",
+    description="Lists all lectures in a course. Only members of the course and admins can access this endpoint. The list is cached for 30 seconds.",
     response_model=schemas.GetLecturesResponse
 )
-def get_course_lectures(course_id: str, session=Depends(get_session), is_member=Depends(is_member_of_course), user=Depends(decode_token)):
-    if not is_member and user["role"] is not models.UserRole.admin:
-        raise HTTPException(status_code=403, detail="Forbidden")
-    query = session.query(models.Lecture, models.LectureUserProgress.completed).outerjoin(models.LectureUserProgress, (models.Lecture.id == models.LectureUserProgress.lecture_id) &(models.LectureUserProgress.user_id == user['id'])).filter(models.Lecture.course_id == course_id).order_by(models.Lecture.name)
-    res = query.all()
+@course_cache(expire=30, per_user=True)
+async def get_course_lectures(course_id: str, session=Depends(get_read_session), user=Depends(decode_token)):
+    query = select(models.Lecture, models.LectureUserProgress.completed).outerjoin(models.LectureUserProgress, (models.Lecture.id == models.LectureUserProgress.lecture_id) &(models.LectureUserProgress.user_id == user['id'])).where(models.Lecture.course_id == course_id).order_by(models.Lecture.name)
+    res = await read_all(session, query)
     return {
         "data": [{
             "id": lecture.id,
@@ -52,6 +78,7 @@ def post_course_lecture(course_id: str, lecture: schemas.PostLectureRequest, ses
         course_id=course_id,
     ))
     session.commit()
+    invalidate_course(course_id)
     logger.info(f"Created lecture {lecture.name} in course {course_id}")
     
     
@@ -64,10 +91,10 @@ def post_course_lecture(course_id: str, lecture: schemas.PostLectureRequest, ses
     summary="Get a specific lecture",
     description="Get a specific lecture. Only members of the course and admins can access this endpoint.",
 )
-def get_course_lecture(course_id: str, lecture_id: str, session=Depends(get_session), is_member=Depends(is_member_of_course), user=Depends(decode_token)):
+async def get_course_lecture(course_id: str, lecture_id: str, session=Depends(get_read_session), is_member=Depends(is_member_of_course), user=Depends(decode_token)):
     if not is_member and user["role"] is not models.UserRole.admin:
         raise HTTPException(status_code=403, detail="Forbidden")
-    res = session.query(models.Lecture, models.LectureUserProgress.completed).outerjoin(models.LectureUserProgress, models.LectureUserProgress.lecture_id == models.Lecture.id).filter(models.Lecture.id == lecture_id).all()
+    res = await read_all(session, select(models.Lecture, models.LectureUserProgress.completed).outerjoin(models.LectureUserProgress, models.LectureUserProgress.lecture_id == models.Lecture.id).where(models.Lecture.id == lecture_id))
     return {
         "data": {
             "id": res[0][0].id,
@@ -80,26 +107,68 @@ def get_course_lecture(course_id: str, lecture_id: str, session=Depends(get_sess
 @router.delete(
     "/{lecture_id}",
     status_code=204,
-    dependencies=[Depends(check_if_course_exists),
-                  Depends(check_if_lecture_exists)],
     tags=["lectures"],
     summary="Delete a lecture",
-    description="Delete a lecture. Only instructors and admins can access this endpoint.",
+    description="Delete a lecture. Only instructors and admins can access this endpoint. The uploaded materials are deleted in the background, the Location header points to the cleanup job. A retry with the same Idempotency-Key returns the job of the first attempt, even though the lecture is gone by then.",
+    responses={
+        409: {"description": "The Idempotency-Key was used for another request"}
+    }
 )
-def delete_course_lecture(course_id: str, lecture_id: str, session=Depends(get_session), user=Depends(decode_token), is_instructor=Depends(is_course_instructor)):
-    if not is_instructor and user["role"] is not models.UserRole.admin:
-        raise HTTPException(status_code=403, detail="Forbidden")
+def delete_course_lecture(course_id: str, lecture_id: str, response: Response, context=Depends(get_request_context), session=Depends(get_session), user=Depends(decode_token), is_instructor=Depends(is_course_instructor), idempotency_key: Optional[str] = Header(default=None)):
+    prefix = f'{course_id}/{lecture_id}/'
     try:
+        job = find_storage_cleanup(session, idempotency_key, user["id"], prefix)
+    except IdempotencyKeyConflict:
+        raise HTTPException(status_code=409, detail="Idempotency-Key was used for another request")
+    if job is None:
+        # the existence checks run after the replay check, a retry finds the lecture deleted
+        if not context["course_exists"]:
+            raise HTTPException(status_code=404, detail="Course not found")
+        if not context["lecture_exists"]:
+            raise HTTPException(status_code=404, detail="Lecture not found")
+        if not is_instructor and user["role"] is not models.UserRole.admin:
+            raise HTTPException(status_code=403, detail="Forbidden")
+        delete_lecture_materials(session, course_id, lecture_id)
         session.query(models.Lecture).filter(
             models.Lecture.id == lecture_id).delete()
-        files_in_lec = list_files(f'{course_id}/{lecture_id}/')
-        for file in files_in_lec:
-            delete_file(file)
-        session.commit()
-    except Exception:
-        session.rollback()
-        raise HTTPException(status_code=500, detail="Internal server error")
-    logger.info(f"Deleted lecture {lecture_id} in course {course_id}")
+        refresh_course_progress(session, course_id)
+        job = enqueue_storage_cleanup(session, prefix, user["id"], idempotency_key)
+        try:
+            job = commit_storage_cleanup(session, job)
+        except IdempotencyKeyConflict:
+            raise HTTPException(status_code=409, detail="Idempotency-Key was used for another request")
+        invalidate_course(course_id)
+        logger.info(f"Deleted lecture {lecture_id} in course {course_id}")
+    response.headers["Location"] = f"/jobs/{job.id}"
+
+
+@router.put(
+    '/status',
+    response_model=schemas.UpdateLectureStatusesResponse,
+    dependencies=[Depends(check_if_course_exists),
+                  Depends(check_if_course_member)],
+    tags=["lectures"],
+    summary="Update the status of many lectures",
+    description=f"Update the status of up to {schemas.LECTURE_STATUS_SYNC_MAX_LECTURES} lectures of the course at once for the currently authenticated user, e.g. to replay changes made offline. If a lecture is listed more than once, the last entry wins. Lectures that do not exist (anymore) are skipped and listed in not_found. Returns the stored status of the other lectures. Only members of the course and admins can access this endpoint.",
+    responses={
+        403: {"description": "Forbidden"}
+    }
+)
+def update_lecture_statuses(course_id: str, body: schemas.UpdateLectureStatusesRequest, user=Depends(decode_token), session=Depends(get_session)):
+    requested = {status.lecture_id: status.completed for status in body.lectures}
+    existing = {lecture_id for lecture_id, in session.query(models.Lecture.id).filter(
+        models.Lecture.course_id == course_id, models.Lecture.id.in_(list(requested)))}
+    stored = _upsert_lecture_statuses(session, user["id"], {lecture_id: completed for lecture_id, completed in requested.items() if lecture_id in existing})
+    if stored:
+        refresh_course_progress(session, course_id, user["id"])
+    session.commit()
+    if stored:
+        invalidate_course(course_id, user["id"])
+    logger.info(f"Updated {len(stored)} lecture statuses for user {user['id']} in course {course_id}")
+    return {
+        "data": [{"lecture_id": lecture_id, "completed": stored[lecture_id]} for lecture_id in requested if lecture_id in stored],
+        "not_found": [lecture_id for lecture_id in requested if lecture_id not in existing]
+    }
 
 
 @router.put(
@@ -114,18 +183,10 @@ def delete_course_lecture(course_id: str, lecture_id: str, session=Depends(get_s
 def update_lecture_status(course_id: str, lecture_id: str, status: schemas.UpdateLectureStatusRequest, user=Depends(decode_token), session=Depends(get_session), is_member=Depends(is_member_of_course)):
     if not is_member and user["role"] is not models.UserRole.admin:
         raise HTTPException(status_code=403, detail="Forbidden")
-    res = session.query(models.LectureUserProgress).filter(
-        models.LectureUserProgress.user_id == user["id"], models.LectureUserProgress.lecture_id == lecture_id).all()
-    if res == []:
-        session.add(models.LectureUserProgress(
-            user_id=user["id"],
-            lecture_id=lecture_id,
-            completed=status.completed
-        ))
-    else:
-        session.query(models.LectureUserProgress).filter(
-            models.LectureUserProgress.user_id == user["id"], models.LectureUserProgress.lecture_id == lecture_id).update({"completed": status.completed})
+    _upsert_lecture_statuses(session, user["id"], {lecture_id: status.completed})
+    refresh_course_progress(session, course_id, user["id"])
     session.commit()
+    invalidate_course(course_id, user["id"])
     logger.info(f"Updated lecture status for user {user['id']} in lecture {lecture_id} to {status.completed}")
     
 @router.get(
@@ -137,15 +198,11 @@ def update_lecture_status(course_id: str, lecture_id: str, status: schemas.Updat
     summary="Get lecture status",
     description="Get lecture status for the currently authenticated user."
 )
-def get_lecture_status(course_id: str, lecture_id: str, user=Depends(decode_token), session=Depends(get_session), is_member=Depends(is_member_of_course)):
+async def get_lecture_status(course_id: str, lecture_id: str, user=Depends(decode_token), session=Depends(get_read_session), is_member=Depends(is_member_of_course)):
     if not is_member and user["role"] is not models.UserRole.admin:
         raise HTTPException(status_code=403, detail="Forbidden")
-    try:
-        return {
-            "completed": session.query(models.LectureUserProgress).filter(
-                models.LectureUserProgress.user_id == user["id"], models.LectureUserProgress.lecture_id == lecture_id).one().completed
-        }
-    except NoResultFound:
-        return {
-            "completed": False
-        }
+    rows = await read_all(session, select(models.LectureUserProgress.completed).where(
+        models.LectureUserProgress.user_id == user["id"], models.LectureUserProgress.lecture_id == lecture_id))
+    return {
+        "completed": rows[0][0] if rows else False
+    }
@@ -0,0 +1,79 @@
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from storage import get_backend
+from storage_backends import PresignedUrlType, UploadNotFound
+from typing import Optional
+from rate_limit import limiter
+from loguru import logger
+from io import BytesIO
+
+router = APIRouter(
+    prefix="/storage",
+    tags=["storage"],
+    include_in_schema=False,
+)
+
+_CHUNK_SIZE = 64 * 1024
+
+
+def _local_backend():
+    backend = get_backend()
+    # only the local backend hands out urls to these routes
+    if not hasattr(backend, "verify"):
+        raise HTTPException(status_code=404, detail="Not found")
+    return backend
+
+
+def _verify(key: str, type: PresignedUrlType, expires: int, signature: str):
+    if not _local_backend().verify(key, type, expires, signature):
+        raise HTTPException(status_code=403, detail="Invalid or expired signature")
+
+
+@router.get(
+    "/{key:path}",
+    summary="Download a file of the local storage backend with a presigned url",
+)
+# S3 does not count downloads against the API rate limit either
+@limiter.exempt
+def download_file(key: str, expires: int, signature: str):
+    _verify(key, PresignedUrlType.GET, expires, signature)
+    try:
+        file = get_backend().stream(key)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    def chunks():
+        with file:
+            while chunk := file.read(_CHUNK_SIZE):
+                yield chunk
+    return StreamingResponse(chunks(), media_type="application/octet-stream")
+
+
+@router.put(
+    "/{key:path}",
+    status_code=200,
+    summary="Upload a file to the local storage backend with a presigned url",
+)
+@limiter.exempt
+async def upload_file(key: str, expires: int, signature: str, request: Request, upload_id: Optional[str] = None, part_number: Optional[int] = None):
+    if upload_id is not None and part_number is not None:
+        return await _upload_part(key, upload_id, part_number, expires, signature, request)
+    _verify(key, PresignedUrlType.PUT, expires, signature)
+    body = await request.body()
+    await run_in_threadpool(get_backend().upload, BytesIO(body), key)
+    logger.info(f"Uploaded file {key} to the local storage")
+
+
+async def _upload_part(key: str, upload_id: str, part_number: int, expires: int, signature: str, request: Request):
+    backend = _local_backend()
+    if not backend.verify_part(key, upload_id, part_number, expires, signature):
+        raise HTTPException(status_code=403, detail="Invalid or expired signature")
+    body = await request.body()
+    try:
+        etag = await run_in_threadpool(backend.upload_part, key, upload_id, part_number, BytesIO(body))
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    logger.trace(f"Uploaded part {part_number} of multipart upload {upload_id} to the local storage")
+    # like S3, the client needs the ETag of every part to complete the upload
+    return Response(status_code=200, headers={"ETag": etag})
@@ -1,8 +1,20 @@
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, Request, Query, Header, Response
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import select
+from fastapi.responses import StreamingResponse
+from urllib.parse import quote
+from typing import Optional
 from dependencies import *
-from storage import list_files, delete_file, get_presigned_url, PresignedUrlType
+from db import read_all
+from lecture_materials import record_material, delete_material
+from storage import get_file_info, delete_file, get_presigned_url, get_presigned_urls, PresignedUrlType
+from storage import create_multipart_upload, presign_upload_parts, complete_multipart_upload, abort_multipart_upload
+from storage_backends import UploadNotFound, InvalidUpload, ObjectChanged
+import async_storage
 import schemas
-from fastapi_cache.decorator import cache
+from response_cache import course_cache, invalidate_course
+from loguru import logger
+import re
 
 router = APIRouter(
     prefix="/courses/{course_id}/lectures/{lecture_id}/materials",
@@ -10,21 +22,69 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
+# a single range: bytes=start-end, bytes=start- or bytes=-suffix_length
+_BYTE_RANGE = re.compile(r"bytes=([0-9]*)-([0-9]*)", re.IGNORECASE)
+# how often a download is started again if the file is replaced while it is opened
+_DOWNLOAD_ATTEMPTS = 3
+
+
+def _parse_range(range_header: str, size: int) -> Optional[tuple[int, int]]:
+    """
+        Parses a single byte range (bytes=start-end, bytes=start- or
+        bytes=-suffix_length) into the first and last byte position.
+
+        :return: None for headers that are not a single valid byte range (e.g. bytes=5-3), which are ignored
+        :raises HTTPException: 416 if the range is valid but not satisfiable
+    """
+    match = _BYTE_RANGE.fullmatch(range_header.strip())
+    if match is None or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":
+        if int(last) == 0:
+            raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    if last != "" and int(last) < start:
+        return None
+    if start >= size:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, min(int(last), size - 1) if last != "" else size - 1
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    # weak comparison, as required for If-None-Match
+    return header.strip() == "*" or etag.removeprefix("W/") in [tag.strip().removeprefix("W/") for tag in header.split(",")]
+
 
 @router.get(
     "/",
     dependencies=[Depends(check_if_course_exists),
-                  Depends(check_if_lecture_exists)],
+                  Depends(check_if_lecture_exists),
+                  Depends(check_if_course_member)],
     response_model=schemas.GetLectureMaterialResponse,
     summary="Get a list of names of files uploaded for a lecture",
-    description="Get a list of names of files uploaded for a lecture. Only course members and admins can access this endpoint. The list is cached for 60 seconds.",
+    description="Get a list of names of files uploaded (and confirmed) for a lecture, sorted by name. Only course members and admins can access this endpoint. The list is cached for 60 seconds. If a limit is given, the list is paginated: pass the returned next_cursor as cursor to get the next page. With presign=true the response also maps every listed file to a presigned download link, which is valid for at least 60 seconds.",
 )
-@cache(expire=60)
-async def get_course_materials(request: Request, course_id: str, lecture_id: str, is_member=Depends(is_member_of_course), user=Depends(decode_token)):
-    if not is_member and user["role"] is not models.UserRole.admin:
-        raise HTTPException(status_code=403, detail="Forbidden")
+@course_cache(expire=60)
+async def get_course_materials(request: Request, course_id: str, lecture_id: str, limit: Optional[int] = Query(default=None, ge=1, le=1000), cursor: Optional[str] = None, presign: bool = False, session=Depends(get_read_session)):
+    query = select(models.LectureMaterial.filename).where(
+        models.LectureMaterial.lecture_id == lecture_id).order_by(models.LectureMaterial.filename)
+    if cursor is not None:
+        query = query.where(models.LectureMaterial.filename > cursor)
+    if limit is not None:
+        query = query.limit(limit + 1)
+    filenames = [filename for filename, in await read_all(session, query)]
+    next_cursor = None
+    if limit is not None and len(filenames) > limit:
+        filenames = filenames[:limit]
+        next_cursor = filenames[-1]
+    # presigning can reach the storage backend, e.g. to refresh credentials
+    urls = await run_in_threadpool(get_presigned_urls, [f'{course_id}/{lecture_id}/{filename}' for filename in filenames]) if presign else None
     return {
-        "data": [key.split('/')[-1] for key in list_files(f'{course_id}/{lecture_id}/')]
+        "data": filenames,
+        "next_cursor": next_cursor,
+        "urls": {key.split('/')[-1]: url for key, url in urls.items()} if urls is not None else None
     }
 
 
@@ -34,29 +94,170 @@ async def get_course_materials(request: Request, course_id: str, lecture_id: str
     dependencies=[Depends(check_if_course_exists),
                   Depends(check_if_lecture_exists)],
     summary="Get link for uploading lecture material",
-    description="Get link for uploading lecture material. If there is already a file with the same name, it will be overwritten. Only course instructors and admins can access this endpoint. The link is presigned which means that it will not work with additional headers. The link is valid for 5 minutes.",
+    description="Get link for uploading lecture material. If there is already a file with the same name, it will be overwritten. Confirm the upload afterwards, the file is not listed before. Only course instructors and admins can access this endpoint. The link is presigned which means that it will not work with additional headers. The link is valid for 5 minutes.",
 )
 def upload_course_material(course_id: str, lecture_id: str, body: schemas.UploadLectureMaterialRequest, user = Depends(decode_token), is_instructor = Depends(is_course_instructor)):
     if user["role"] is not models.UserRole.admin or not is_instructor:
         raise HTTPException(status_code=403, detail="You have to be an admin or instructor to upload lecture material")
+    # nothing is listed before the upload is confirmed, which invalidates the listing
     return get_presigned_url(f'{course_id}/{lecture_id}/{body.filename}', PresignedUrlType.PUT)
 
 
+@router.post(
+    "/{filename}/confirm",
+    response_model=schemas.LectureMaterial,
+    dependencies=[Depends(check_if_course_exists),
+                  Depends(check_if_lecture_exists)],
+    summary="Confirm an upload of lecture material",
+    description="Records lecture material that was uploaded with a presigned link, so that it is listed and can be downloaded. Returns the size, content type and ETag of the stored file. Only course instructors and admins can access this endpoint.",
+    responses={
+        403: {"description": "Forbidden"},
+        404: {"description": "File not found"}
+    }
+)
+def confirm_course_material_upload(course_id: str, lecture_id: str, filename: str, session=Depends(get_session), user=Depends(decode_token), is_instructor=Depends(is_course_instructor)):
+    if not is_instructor and user["role"] is not models.UserRole.admin:
+        raise HTTPException(status_code=403, detail="You have to be an admin or instructor to upload lecture material")
+    info = get_file_info(f'{course_id}/{lecture_id}/{filename}')
+    if info is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    record_material(session, lecture_id, filename, info)
+    session.commit()
+    invalidate_course(course_id, lecture_id=lecture_id)
+    return session.get(models.LectureMaterial, (lecture_id, filename))
+
+
+@router.post(
+    "/{filename}/multipart",
+    status_code=201,
+    dependencies=[Depends(check_if_course_exists),
+                  Depends(check_if_lecture_exists)],
+    response_model=schemas.CreateMultipartUploadResponse,
+    summary="Start a multipart upload of lecture material",
+    description="Starts an upload of lecture material in parts, for large files such as lecture videos. Upload the parts (at least 5 MB each, except the last one) in parallel to the urls of the parts endpoint, keep the ETag header of every response and then complete the upload. A failed part can be uploaded again. Uploads that are neither completed nor aborted are aborted after a day. If there is already a file with the same name, it will be overwritten on completion. Only course instructors and admins can access this endpoint.",
+)
+def create_course_material_upload(course_id: str, lecture_id: str, filename: str, user=Depends(decode_token), is_instructor=Depends(is_course_instructor)):
+    if not is_instructor and user["role"] is not models.UserRole.admin:
+        raise HTTPException(status_code=403, detail="You have to be an admin or instructor to upload lecture material")
+    return {"upload_id": create_multipart_upload(f'{course_id}/{lecture_id}/{filename}')}
+
+
+@router.post(
+    "/{filename}/multipart/{upload_id}/parts",
+    dependencies=[Depends(check_if_course_exists),
+                  Depends(check_if_lecture_exists)],
+    response_model=schemas.PresignUploadPartsResponse,
+    summary="Get links for uploading parts of lecture material",
+    description="Get a presigned upload link (PUT) for every given part number of a multipart upload. The links are valid for an hour; request new ones to resume an upload. Only course instructors and admins can access this endpoint.",
+)
+def presign_course_material_upload_parts(course_id: str, lecture_id: str, filename: str, upload_id: str, body: schemas.PresignUploadPartsRequest, user=Depends(decode_token), is_instructor=Depends(is_course_instructor)):
+    if not is_instructor and user["role"] is not models.UserRole.admin:
+        raise HTTPException(status_code=403, detail="You have to be an admin or instructor to upload lecture material")
+    return {"urls": presign_upload_parts(f'{course_id}/{lecture_id}/{filename}', upload_id, body.part_numbers)}
+
+
+@router.post(
+    "/{filename}/multipart/{upload_id}/complete",
+    status_code=204,
+    dependencies=[Depends(check_if_course_exists),
+                  Depends(check_if_lecture_exists)],
+    summary="Complete a multipart upload of lecture material",
+    description="Assembles the lecture material from the uploaded parts, given by their part numbers and the ETags returned by the part uploads, and records it like the confirm endpoint. Only course instructors and admins can access this endpoint.",
+    responses={
+        400: {"description": "A part is missing or has a different ETag"},
+        403: {"description": "Forbidden"},
+    }
+)
+def complete_course_material_upload(course_id: str, lecture_id: str, filename: str, upload_id: str, body: schemas.CompleteMultipartUploadRequest, session=Depends(get_session), user=Depends(decode_token), is_instructor=Depends(is_course_instructor)):
+    if not is_instructor and user["role"] is not models.UserRole.admin:
+        raise HTTPException(status_code=403, detail="You have to be an admin or instructor to upload lecture material")
+    key = f'{course_id}/{lecture_id}/{filename}'
+    try:
+        complete_multipart_upload(key, upload_id, [part.model_dump() for part in body.parts])
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except InvalidUpload as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    record_material(session, lecture_id, filename, get_file_info(key))
+    session.commit()
+    invalidate_course(course_id, lecture_id=lecture_id)
+
+
+@router.delete(
+    "/{filename}/multipart/{upload_id}",
+    status_code=204,
+    dependencies=[Depends(check_if_course_exists),
+                  Depends(check_if_lecture_exists)],
+    summary="Abort a multipart upload of lecture material",
+    description="Aborts a multipart upload and discards its uploaded parts. Only course instructors and admins can access this endpoint.",
+)
+def abort_course_material_upload(course_id: str, lecture_id: str, filename: str, upload_id: str, user=Depends(decode_token), is_instructor=Depends(is_course_instructor)):
+    if not is_instructor and user["role"] is not models.UserRole.admin:
+        raise HTTPException(status_code=403, detail="You have to be an admin or instructor to upload lecture material")
+    abort_multipart_upload(f'{course_id}/{lecture_id}/{filename}', upload_id)
+
+
 @router.get(
     "/{filename}",
     dependencies=[Depends(check_if_course_exists), Depends(
-        check_if_lecture_exists)],
+        check_if_lecture_exists), Depends(check_if_file_exists)],
     summary="Get link for downloading lecture material",
     description="Get link for downloading lecture material. Only course members and admins can access this endpoint. The link is presigned which means that it will not work with additional headers. The link is valid for 5 minutes.",
 )
 def get_course_material(course_id: str, lecture_id: str, filename: str, is_member=Depends(is_member_of_course), user=Depends(decode_token)):
     if not is_member and user["role"] is not models.UserRole.admin:
         raise HTTPException(status_code=403, detail="Forbidden")
-    if not filename in [key.split('/')[-1] for key in list_files(f'{course_id}/{lecture_id}/')]:
-        raise HTTPException(status_code=404, detail="File not found")
     return get_presigned_url(f'{course_id}/{lecture_id}/{filename}')
 
 
+@router.get(
+    "/{filename}/content",
+    dependencies=[Depends(check_if_course_exists),
+                  Depends(check_if_lecture_exists),
+                  Depends(check_if_course_member),
+                  Depends(check_if_file_exists)],
+    summary="Download lecture material through the API",
+    description="Streams the content of lecture material through the API, for clients that cannot reach the storage directly. Supports single byte ranges (Range, If-Range) and conditional requests (If-None-Match with the returned ETag). Only course members and admins can access this endpoint.",
+    responses={
+        206: {"description": "Partial content"},
+        304: {"description": "Not modified"},
+        403: {"description": "Forbidden"},
+        416: {"description": "Range not satisfiable"},
+        503: {"description": "The file is being replaced"}
+    }
+)
+async def download_course_material(course_id: str, lecture_id: str, filename: str, range_header: Optional[str] = Header(default=None, alias="Range"), if_range: Optional[str] = Header(default=None), if_none_match: Optional[str] = Header(default=None)):
+    key = f'{course_id}/{lecture_id}/{filename}'
+    # the GET only returns the version the HEAD described, if the file was replaced in between the response is built again
+    for _ in range(_DOWNLOAD_ATTEMPTS):
+        info = await async_storage.get_file_info(key)
+        if info is None:
+            raise HTTPException(status_code=404, detail="File not found")
+        headers = {
+            "ETag": info["etag"],
+            "Accept-Ranges": "bytes",
+            "Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}",
+        }
+        if if_none_match is not None and _etag_matches(if_none_match, info["etag"]):
+            return Response(status_code=304, headers=headers)
+
+        size = info["size"]
+        # a range only applies to the version of the file the client already has a part of
+        byte_range = _parse_range(range_header, size) if range_header is not None and size > 0 and (if_range is None or if_range.strip() == info["etag"]) else None
+        start, end = byte_range if byte_range is not None else (0, size - 1)
+        if byte_range is not None:
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        try:
+            # streamed in chunks on the event loop, the memory a download needs does not depend on the file size
+            body = await async_storage.get_file(key, start, end, etag=info["etag"]) if size > 0 else iter(())
+        except ObjectChanged:
+            logger.info(f"File {key} changed while it was opened, retrying")
+            continue
+        return StreamingResponse(body, status_code=206 if byte_range is not None else 200, media_type=info["content_type"], headers=headers)
+    raise HTTPException(status_code=503, detail="The file is being replaced, try again later")
+
+
 @router.delete(
     "/{filename}",
     status_code=204,
@@ -65,7 +266,10 @@ def get_course_material(course_id: str, lecture_id: str, filename: str, is_membe
     summary="Delete lecture material",
     description="Delete lecture material. Only course instructors and admins can access this endpoint.",
 )
-def delete_course_material(course_id: str, lecture_id: str, filename: str, user = Depends(decode_token), is_instructor = Depends(is_course_instructor)):
+def delete_course_material(course_id: str, lecture_id: str, filename: str, session=Depends(get_session), user = Depends(decode_token), is_instructor = Depends(is_course_instructor)):
     if user["role"] is not models.UserRole.admin or not is_instructor:
         raise HTTPException(status_code=403, detail="You have to be an admin or instructor to delete lecture material")
-    return delete_file(f'{course_id}/{lecture_id}/{filename}')
+    delete_material(session, lecture_id, filename)
+    session.commit()
+    delete_file(f'{course_id}/{lecture_id}/{filename}')
+    invalidate_course(course_id, lecture_id=lecture_id)
@@ -1,5 +1,17 @@
-from pydantic import BaseModel
-from models import UserRole
+from pydantic import BaseModel, Field
+from typing import Annotated, Optional
+from models import UserRole, JobStatus
+from datetime import datetime
+import enum
+
+# upper bound of the users in one bulk enrollment request
+BULK_ENROLLMENT_MAX_USERS = 5000
+# upper bound of the lectures in one progress sync request
+LECTURE_STATUS_SYNC_MAX_LECTURES = 1000
+# S3 limits for multipart uploads
+MULTIPART_UPLOAD_MAX_PARTS = 10000
+# upper bound of the part urls presigned in one request
+MULTIPART_PRESIGN_MAX_PARTS = 1000
 
 class Course(BaseModel):
     id : str
@@ -17,10 +29,22 @@ class GetLecturesResponse(BaseModel):
         "from_attributes": True
     }
     
+class LectureOverview(Lecture):
+    materials: list[str]
+    
+class CourseOverview(Course):
+    lectures: list[LectureOverview]
+    
+class GetCourseOverviewResponse(BaseModel):
+    data: CourseOverview
+    
 class PostUserRequest(BaseModel):
     name: str
     role: UserRole
     
+class UpdateUserRoleRequest(BaseModel):
+    role: UserRole
+    
 class PostLectureRequest(BaseModel):
     name: str
     
@@ -34,6 +58,33 @@ class GetLectureResponse(BaseModel):
 class UploadLectureMaterialRequest(BaseModel):
     filename: str
     
+class LectureMaterial(BaseModel):
+    filename: str
+    size: int
+    content_type: str
+    etag: str
+    uploaded_at: datetime
+    
+    model_config = {
+        "from_attributes": True
+    }
+    
+class CreateMultipartUploadResponse(BaseModel):
+    upload_id: str
+    
+class PresignUploadPartsRequest(BaseModel):
+    part_numbers: list[Annotated[int, Field(ge=1, le=MULTIPART_UPLOAD_MAX_PARTS)]] = Field(min_length=1, max_length=MULTIPART_PRESIGN_MAX_PARTS)
+    
+class PresignUploadPartsResponse(BaseModel):
+    urls: dict[int, str]
+    
+class UploadedPart(BaseModel):
+    part_number: int = Field(ge=1, le=MULTIPART_UPLOAD_MAX_PARTS)
+    etag: str
+    
+class CompleteMultipartUploadRequest(BaseModel):
+    parts: list[UploadedPart] = Field(min_length=1, max_length=MULTIPART_UPLOAD_MAX_PARTS)
+    
 class PostCourseRequest(BaseModel):
     name: str
     
@@ -46,6 +97,8 @@ class LoginRequest(BaseModel):
     
 class GetLectureMaterialResponse(BaseModel):
     data: list[str]
+    next_cursor: Optional[str] = None
+    urls: Optional[dict[str, str]] = None
     
     model_config = {
         "json_schema_extra": {
@@ -54,7 +107,8 @@ class GetLectureMaterialResponse(BaseModel):
                     "file1.pdf",
                     "file2.txt",
                     "file3.docx"
-                ]
+                ],
+                "next_cursor": "file3.docx"
             }
         
         }
@@ -67,6 +121,7 @@ class User(BaseModel):
     
 class GetUserResponse(BaseModel):
     data: list[User]
+    next_cursor: Optional[str] = None
     
     model_config = {
         "from_attributes": True
@@ -74,6 +129,7 @@ class GetUserResponse(BaseModel):
         
 class GetCoursesResponse(BaseModel):
     data: list[Course]
+    next_cursor: Optional[str] = None
     
     model_config = {
         "from_attributes": True
@@ -90,16 +146,42 @@ class AddUserToCourseRequest(BaseModel):
     user_id: str
     is_instructor: bool = False
     
+class BulkAddUsersToCourseRequest(BaseModel):
+    users: list[AddUserToCourseRequest] = Field(max_length=BULK_ENROLLMENT_MAX_USERS)
+    
+class BulkEnrollmentStatus(str, enum.Enum):
+    added = "added"
+    already_member = "already_member"
+    user_not_found = "user_not_found"
+    forbidden = "forbidden"
+    
+class BulkEnrollmentResult(BaseModel):
+    user_id: str
+    status: BulkEnrollmentStatus
+    
+class BulkAddUsersToCourseResponse(BaseModel):
+    data: list[BulkEnrollmentResult]
+    
 class CourseMember(User):
     is_instructor: bool
     
 class GetCourseMembersResponse(BaseModel):
     data: list[CourseMember]
+    next_cursor: Optional[str] = None
     
     model_config = {
         "from_attributes": True
     }
     
+class CourseMemberProgress(User):
+    completed_lectures: int
+    completion_ratio: float
+    
+class GetCourseProgressResponse(BaseModel):
+    lectures: int
+    data: list[CourseMemberProgress]
+    next_cursor: Optional[str] = None
+    
 class UpdateCourseMemberInstrucorStatusRequest(BaseModel):
     is_instructor: bool
     
@@ -107,4 +189,28 @@ class UpdateLectureStatusRequest(BaseModel):
     completed: bool
 
 class GetLectureStatusResponse(BaseModel):
-    completed: bool
\ No newline at end of file
+    completed: bool
+
+class LectureStatus(BaseModel):
+    lecture_id: str
+    completed: bool
+
+class UpdateLectureStatusesRequest(BaseModel):
+    lectures: list[LectureStatus] = Field(max_length=LECTURE_STATUS_SYNC_MAX_LECTURES)
+
+class UpdateLectureStatusesResponse(BaseModel):
+    data: list[LectureStatus]
+    not_found: list[str]
+
+class Job(BaseModel):
+    id: str
+    prefix: str
+    status: JobStatus
+    attempts: int
+    last_error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+    model_config = {
+        "from_attributes": True
+    }
@@ -1,86 +1,200 @@
-import boto3
 import os
 import dotenv
 from io import IOBase
-from botocore.response import StreamingBody
-from enum import Enum
+from collections import OrderedDict
+from threading import Lock
+from typing import BinaryIO, Iterator, Optional
+from datetime import datetime, timedelta, timezone
 from loguru import logger
+from storage_backends import StorageBackend, PresignedUrlType, create_backend
+import time
 
 dotenv.load_dotenv()
 
-_BUCKET_NAME = os.getenv("S3_BUCKET")
-_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
-_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
+_PRESIGN_EXPIRY = 5 * 60
+# cached GET urls are handed out until they have less than this many seconds left
+_PRESIGN_MIN_REMAINING = int(os.getenv("S3_PRESIGN_MIN_REMAINING", "120"))
+_PRESIGN_CACHE_SIZE = int(os.getenv("S3_PRESIGN_CACHE_SIZE", "10000"))
+# parts of large files take longer to upload than a whole small file
+_PART_PRESIGN_EXPIRY = int(os.getenv("S3_PART_PRESIGN_EXPIRY", "3600"))
 
-_s3_client = boto3.client(
-    "s3",
-    aws_access_key_id=_ACCESS_KEY_ID,
-    aws_secret_access_key=_SECRET_ACCESS_KEY,
-)
+_backend: Optional[StorageBackend] = None
+_backend_lock = Lock()
 
+_presign_cache: OrderedDict[str, tuple[float, str]] = OrderedDict()
+_presign_cache_lock = Lock()
 
-class PresignedUrlType(Enum):
-    GET = "get_object"
-    PUT = "put_object"
+
+def get_backend() -> StorageBackend:
+    """
+        Returns the backend selected with STORAGE_BACKEND, created on first use.
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend()
+    return _backend
+
+
+def set_backend(backend: StorageBackend) -> None:
+    """
+        Replaces the backend, e.g. in tests and benchmarks, and drops the
+        cached presigned urls.
+    """
+    global _backend
+    with _backend_lock:
+        _backend = backend
+    with _presign_cache_lock:
+        _presign_cache.clear()
 
 
 def upload_file(file_obj: IOBase, key: str) -> None:
     """
-        Uploads a file to S3
+        Uploads a file to the storage
 
         :param file_obj: The file object to upload
         :param key: The key to upload the file to
     """
+    get_backend().upload(file_obj, key)
 
-    _s3_client.upload_fileobj(
-        file_obj,
-        _BUCKET_NAME,
-        key,
-    )
 
+def get_file(key: str, start: int = 0, end: Optional[int] = None) -> BinaryIO:
+    """
+        Opens a file for reading, optionally only the bytes from start up to
+        and including end. The caller has to close it.
+    """
+    return get_backend().stream(key, start, end)
 
-def get_file(key: str) -> StreamingBody:
-    return _s3_client.get_object(
-        Bucket=_BUCKET_NAME,
-        Key=key,
-    )["Body"]
+
+def get_file_info(key: str) -> Optional[dict]:
+    """
+        Returns the size, the ETag and the content type of a file, or None if
+        it does not exist.
+    """
+    return get_backend().info(key)
 
 
 def delete_file(key: str) -> None:
-    _s3_client.delete_object(
-        Bucket=_BUCKET_NAME,
-        Key=key,
-    )
+    get_backend().delete(key)
     logger.info(f"Deleted file {key}")
 
 
-def list_files(prefix: str) -> list[str]:
-    res = _s3_client.list_objects_v2(
-        Bucket=_BUCKET_NAME,
-        Prefix=prefix,
-    )
-    if "Contents" not in res:
-        return []
-    return [
-        item["Key"]
-        for item in res["Contents"]
-    ]
+def delete_prefix(prefix: str) -> list[dict]:
+    """
+        Deletes every object below a prefix.
+
+        :param prefix: The prefix to delete
+        :return: The keys that could not be deleted, with the error code and message
+    """
+    # parts of unfinished uploads are stored (and billed) until the upload is aborted
+    abort_multipart_uploads(prefix)
+    deleted, failures = get_backend().delete_prefix(prefix)
+    logger.info(f"Deleted {deleted} files below {prefix}")
+    if failures:
+        logger.warning(f"Failed to delete {len(failures)} files below {prefix}")
+    return failures
 
 
-def check_if_file_exists(key: str) -> bool:
-    return len(list_files(key)) > 0
+def create_multipart_upload(key: str) -> str:
+    """
+        Starts a multipart upload, whose parts can be uploaded in parallel with
+        the urls of presign_upload_parts.
+
+        :return: The upload id
+    """
+    upload_id = get_backend().create_multipart_upload(key)
+    logger.info(f"Started multipart upload {upload_id} to {key}")
+    return upload_id
+
+
+def presign_upload_parts(key: str, upload_id: str, part_numbers: list[int]) -> dict[int, str]:
+    """
+        Returns an upload url for every part number, valid for
+        S3_PART_PRESIGN_EXPIRY seconds. Presigning does not check that the
+        upload exists, uploading to the url does.
+    """
+    backend = get_backend()
+    return {part_number: backend.presign_part(key, upload_id, part_number, _PART_PRESIGN_EXPIRY) for part_number in part_numbers}
+
+
+def complete_multipart_upload(key: str, upload_id: str, parts: list[dict]) -> None:
+    """
+        Assembles the file from the uploaded parts.
+
+        :param parts: The part_number and etag of every part
+        :raises UploadNotFound: If there is no such upload for the key
+        :raises InvalidUpload: If a part is missing or was uploaded with a different ETag
+    """
+    get_backend().complete_multipart_upload(key, upload_id, parts)
+    logger.info(f"Completed multipart upload {upload_id} to {key}")
+
+
+def abort_multipart_upload(key: str, upload_id: str) -> None:
+    get_backend().abort_multipart_upload(key, upload_id)
+    logger.info(f"Aborted multipart upload {upload_id} to {key}")
+
+
+def abort_multipart_uploads(prefix: str, older_than: Optional[float] = None) -> int:
+    """
+        Aborts the multipart uploads in progress below a prefix.
+
+        :param older_than: Only abort uploads started at least this many seconds ago
+        :return: The number of aborted uploads
+    """
+    backend = get_backend()
+    started_before = datetime.now(timezone.utc) - timedelta(seconds=older_than) if older_than is not None else None
+    aborted = 0
+    for upload in list(backend.list_multipart_uploads(prefix)):
+        if started_before is not None and upload["initiated"] > started_before:
+            continue
+        backend.abort_multipart_upload(upload["key"], upload["upload_id"])
+        aborted += 1
+    if aborted:
+        logger.info(f"Aborted {aborted} multipart uploads below {prefix}")
+    return aborted
+
+
+def iter_files(prefix: str, start_after: Optional[str] = None, page_size: int = 1000) -> Iterator[str]:
+    """
+        Streams the keys below a prefix in lexicographic order.
+
+        :param prefix: The prefix to list
+        :param start_after: Only keys that sort after this key are returned
+        :param page_size: The number of keys fetched per request (at most 1000)
+    """
+    return get_backend().list_keys(prefix, start_after, page_size)
+
+
+def list_files(prefix: str) -> list[str]:
+    return list(iter_files(prefix))
 
 
 def get_presigned_url(key: str, type: PresignedUrlType = PresignedUrlType.GET) -> str:
+    """
+        Returns a url that is valid for 5 minutes. GET urls are cached and
+        reused until less than S3_PRESIGN_MIN_REMAINING seconds are left.
+    """
+    if type == PresignedUrlType.GET:
+        with _presign_cache_lock:
+            entry = _presign_cache.get(key)
+            if entry is not None and entry[0] - time.monotonic() >= _PRESIGN_MIN_REMAINING:
+                _presign_cache.move_to_end(key)
+                return entry[1]
     logger.trace(f"Generating presigned url for {key}")
-    return _s3_client.generate_presigned_url(
-        "get_object" if type == PresignedUrlType.GET else "put_object",
-        Params={
-            "Bucket": _BUCKET_NAME,
-            "Key": key,
-        },
-        ExpiresIn=5 * 60,
-    )
+    expires_at = time.monotonic() + _PRESIGN_EXPIRY
+    url = get_backend().presign(key, type, _PRESIGN_EXPIRY)
+    if type == PresignedUrlType.GET:
+        with _presign_cache_lock:
+            _presign_cache[key] = (expires_at, url)
+            _presign_cache.move_to_end(key)
+            while len(_presign_cache) > _PRESIGN_CACHE_SIZE:
+                _presign_cache.popitem(last=False)
+    return url
+
+
+def get_presigned_urls(keys: list[str]) -> dict[str, str]:
+    return {key: get_presigned_url(key) for key in keys}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,819 @@
+from aiobotocore.session import get_session as get_aio_session
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from enum import Enum
+from io import BytesIO, IOBase
+from threading import Lock
+from typing import AsyncIterator, BinaryIO, Iterator, Optional, Protocol
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import quote, urlencode
+import anyio.to_thread
+import asyncio
+import boto3
+import dotenv
+import hashlib
+import hmac
+import inspect
+import mimetypes
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+
+dotenv.load_dotenv()
+
+# s3 or local
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "s3")
+# added to every storage operation, e.g. to benchmark the local backend with realistic latencies
+_LATENCY_MS = float(os.getenv("STORAGE_LATENCY_MS", "0"))
+
+_BUCKET_NAME = os.getenv("S3_BUCKET")
+_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
+_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
+# e.g. a local MinIO or moto server, defaults to AWS
+_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "50"))
+_CONNECT_TIMEOUT = float(os.getenv("S3_CONNECT_TIMEOUT", "5"))
+_READ_TIMEOUT = float(os.getenv("S3_READ_TIMEOUT", "30"))
+_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", "5"))
+_DELETE_CONCURRENCY = int(os.getenv("S3_DELETE_CONCURRENCY", "4"))
+# requests of the async client in flight at the same time (per event loop), the rest wait for a free slot
+_ASYNC_CONCURRENCY = int(os.getenv("S3_ASYNC_CONCURRENCY", "50"))
+_STREAM_CHUNK_SIZE = 64 * 1024
+# how a GET with IfMatch fails if the object was replaced or deleted in the meantime
+_OBJECT_CHANGED_CODES = ("PreconditionFailed", "NoSuchKey", "412", "404")
+# DeleteObjects accepts at most 1000 keys per request
+_DELETE_BATCH_SIZE = 1000
+
+_LOCAL_ROOT = os.getenv("STORAGE_LOCAL_ROOT", os.path.join(tempfile.gettempdir(), "storage"))
+# the app itself serves the files of the local backend, see routers/local_storage.py
+_LOCAL_BASE_URL = os.getenv("STORAGE_LOCAL_BASE_URL", "http://localhost:8000")
+_LOCAL_SECRET = os.getenv("STORAGE_LOCAL_SECRET", "secret")
+# temporary files of uploads in progress, never listed
+_LOCAL_UPLOAD_PREFIX = ".upload-"
+# parts of multipart uploads in progress, one directory per upload below the root, never listed
+_LOCAL_MULTIPART_DIR = ".multipart"
+
+
+class PresignedUrlType(Enum):
+    GET = "get_object"
+    PUT = "put_object"
+    UPLOAD_PART = "upload_part"
+
+
+class UploadNotFound(Exception):
+    """
+        The multipart upload does not exist (any more), e.g. because it was
+        completed or aborted, or it belongs to another key.
+    """
+
+
+class InvalidUpload(Exception):
+    """
+        The parts given to complete a multipart upload do not match the
+        uploaded parts.
+    """
+
+
+class ObjectChanged(Exception):
+    """
+        The object was replaced or deleted since the caller read its ETag.
+    """
+
+
+class StorageBackend(Protocol):
+    """
+        The operations storage.py needs from an object store. Keys are paths
+        like "course_id/lecture_id/filename".
+    """
+
+    def list_keys(self, prefix: str, start_after: Optional[str] = None, page_size: int = 1000) -> Iterator[str]:
+        """
+            Streams the keys below a prefix in lexicographic order.
+        """
+
+    def presign(self, key: str, type: PresignedUrlType, expires_in: int) -> str:
+        """
+            Returns a url that allows the holder to download (GET) or upload
+            (PUT) the object for the given number of seconds.
+        """
+
+    def upload(self, file_obj: IOBase, key: str) -> None:
+        ...
+
+    def info(self, key: str) -> Optional[dict]:
+        """
+            Returns the size (in bytes), the ETag (quoted) and the content type
+            of the object, or None if it does not exist.
+        """
+
+    def stream(self, key: str, start: int = 0, end: Optional[int] = None, etag: Optional[str] = None) -> BinaryIO:
+        """
+            Opens the object for reading, optionally only the bytes from start
+            up to and including end.
+
+            :param etag: Only open the object if it still has this ETag
+            :raises ObjectChanged: If the object does not have the given ETag (any more)
+        """
+
+    def delete(self, key: str) -> None:
+        """
+            Deletes the object. Deleting a missing object is not an error.
+        """
+
+    def delete_prefix(self, prefix: str) -> tuple[int, list[dict]]:
+        """
+            Deletes every object below a prefix.
+
+            :return: The number of deleted objects and the keys that could not be deleted, with an error code and message
+        """
+
+    def create_multipart_upload(self, key: str) -> str:
+        """
+            Starts a multipart upload to the key and returns its upload id.
+        """
+
+    def presign_part(self, key: str, upload_id: str, part_number: int, expires_in: int) -> str:
+        """
+            Returns a url that allows the holder to upload (PUT) one part of a
+            multipart upload. The ETag header of the response identifies the
+            part when the upload is completed.
+        """
+
+    def complete_multipart_upload(self, key: str, upload_id: str, parts: list[dict]) -> None:
+        """
+            Assembles the object from the uploaded parts.
+
+            :param parts: The part_number and etag of every part of the object
+            :raises UploadNotFound: If there is no such upload for the key
+            :raises InvalidUpload: If a part is missing or was uploaded with a different ETag
+        """
+
+    def abort_multipart_upload(self, key: str, upload_id: str) -> None:
+        """
+            Discards an upload and its parts. Aborting a missing upload is not
+            an error.
+        """
+
+    def list_multipart_uploads(self, prefix: str) -> Iterator[dict]:
+        """
+            Streams the key, the upload_id and the initiation time (an aware
+            datetime) of every upload in progress below a prefix.
+        """
+
+    # The async methods do the same as their sync counterparts without
+    # blocking the event loop, for async routes.
+
+    def list_keys_async(self, prefix: str, start_after: Optional[str] = None, page_size: int = 1000) -> AsyncIterator[str]:
+        ...
+
+    async def upload_async(self, data: bytes, key: str) -> None:
+        ...
+
+    async def info_async(self, key: str) -> Optional[dict]:
+        ...
+
+    async def stream_async(self, key: str, start: int = 0, end: Optional[int] = None, etag: Optional[str] = None, chunk_size: int = _STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        """
+            Opens the object like stream and returns its content, optionally
+            only the bytes from start up to and including end, in chunks of
+            at most chunk_size bytes.
+        """
+
+    async def delete_async(self, key: str) -> None:
+        ...
+
+    async def close_async(self) -> None:
+        """
+            Releases the connections of the async methods, e.g. on shutdown.
+        """
+
+
+def client_options() -> dict:
+    """
+        Returns the options for creating the S3 client of S3Backend.
+    """
+    return {
+        "aws_access_key_id": _ACCESS_KEY_ID,
+        "aws_secret_access_key": _SECRET_ACCESS_KEY,
+        "endpoint_url": _ENDPOINT_URL,
+        "config": Config(
+            max_pool_connections=_MAX_POOL_CONNECTIONS,
+            connect_timeout=_CONNECT_TIMEOUT,
+            read_timeout=_READ_TIMEOUT,
+            # adaptive retries also slow down the client when S3 starts throttling
+            retries={"total_max_attempts": _MAX_ATTEMPTS, "mode": "adaptive"},
+        ),
+    }
+
+
+class S3Backend:
+
+    def __init__(self, bucket: Optional[str] = _BUCKET_NAME):
+        self.bucket = bucket
+        self._s3_client = None
+        self._s3_client_lock = Lock()
+        self._async_client = None
+        self._async_client_context = None
+        self._async_client_loop = None
+        self._async_semaphore = None
+
+    def _client(self):
+        if self._s3_client is None:
+            with self._s3_client_lock:
+                if self._s3_client is None:
+                    self._s3_client = boto3.client("s3", **client_options())
+        return self._s3_client
+
+    async def _get_async_client(self):
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client_loop is not loop:
+            # an aiobotocore client is bound to the event loop it was created in
+            context = get_aio_session().create_client("s3", **client_options())
+            client = await context.__aenter__()
+            if self._async_client is not None and self._async_client_loop is loop:
+                # another request created one in the meantime
+                await context.__aexit__(None, None, None)
+                return self._async_client
+            self._async_client, self._async_client_context, self._async_client_loop = client, context, loop
+            self._async_semaphore = asyncio.Semaphore(_ASYNC_CONCURRENCY)
+        return self._async_client
+
+    @asynccontextmanager
+    async def _async_s3(self):
+        client = await self._get_async_client()
+        async with self._async_semaphore:
+            yield client
+
+    def _list_params(self, prefix: str, start_after: Optional[str], page_size: int) -> dict:
+        params = {
+            "Bucket": self.bucket,
+            "Prefix": prefix,
+            "MaxKeys": page_size,
+        }
+        if start_after is not None:
+            params["StartAfter"] = start_after
+        return params
+
+    def _get_params(self, key: str, start: int, end: Optional[int], etag: Optional[str]) -> dict:
+        params = {
+            "Bucket": self.bucket,
+            "Key": key,
+        }
+        if start > 0 or end is not None:
+            params["Range"] = f"bytes={start}-{end if end is not None else ''}"
+        if etag is not None:
+            params["IfMatch"] = etag
+        return params
+
+    @staticmethod
+    def _info(res: dict) -> dict:
+        return {
+            "size": res["ContentLength"],
+            "etag": res["ETag"],
+            "content_type": res.get("ContentType") or "application/octet-stream",
+        }
+
+    def list_keys(self, prefix: str, start_after: Optional[str] = None, page_size: int = 1000) -> Iterator[str]:
+        params = self._list_params(prefix, start_after, page_size)
+        while True:
+            res = self._client().list_objects_v2(**params)
+            for item in res.get("Contents", []):
+                yield item["Key"]
+            if not res.get("IsTruncated"):
+                return
+            params["ContinuationToken"] = res["NextContinuationToken"]
+
+    def presign(self, key: str, type: PresignedUrlType, expires_in: int) -> str:
+        return self._client().generate_presigned_url(
+            type.value,
+            Params={
+                "Bucket": self.bucket,
+                "Key": key,
+            },
+            ExpiresIn=expires_in,
+        )
+
+    def upload(self, file_obj: IOBase, key: str) -> None:
+        self._client().upload_fileobj(
+            file_obj,
+            self.bucket,
+            key,
+        )
+
+    def info(self, key: str) -> Optional[dict]:
+        try:
+            res = self._client().head_object(
+                Bucket=self.bucket,
+                Key=key,
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey", "NotFound"):
+                raise
+            return None
+        return self._info(res)
+
+    def stream(self, key: str, start: int = 0, end: Optional[int] = None, etag: Optional[str] = None) -> BinaryIO:
+        try:
+            return self._client().get_object(**self._get_params(key, start, end, etag))["Body"]
+        except ClientError as e:
+            if etag is None or e.response["Error"]["Code"] not in _OBJECT_CHANGED_CODES:
+                raise
+            raise ObjectChanged(f"{key} does not have the ETag {etag} any more") from e
+
+    def delete(self, key: str) -> None:
+        self._client().delete_object(
+            Bucket=self.bucket,
+            Key=key,
+        )
+
+    def _delete_batch(self, keys: list[str]) -> tuple[int, list[dict]]:
+        res = self._client().delete_objects(
+            Bucket=self.bucket,
+            Delete={
+                "Objects": [{"Key": key} for key in keys],
+                "Quiet": True,
+            },
+        )
+        errors = [
+            {"key": error["Key"], "code": error.get("Code"), "message": error.get("Message")}
+            for error in res.get("Errors", [])
+        ]
+        return len(keys) - len(errors), errors
+
+    def delete_prefix(self, prefix: str) -> tuple[int, list[dict]]:
+        """
+            Deletes with DeleteObjects requests of up to 1000 keys, running up
+            to S3_DELETE_CONCURRENCY requests in parallel while the listing is
+            still being streamed.
+        """
+        deleted = 0
+        failures = []
+
+        def collect(futures):
+            nonlocal deleted
+            for future in futures:
+                batch_deleted, batch_failures = future.result()
+                deleted += batch_deleted
+                failures.extend(batch_failures)
+
+        with ThreadPoolExecutor(max_workers=_DELETE_CONCURRENCY) as pool:
+            pending = set()
+            batch = []
+            for key in self.list_keys(prefix):
+                batch.append(key)
+                if len(batch) < _DELETE_BATCH_SIZE:
+                    continue
+                pending.add(pool.submit(self._delete_batch, batch))
+                batch = []
+                if len(pending) >= _DELETE_CONCURRENCY:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+            if batch:
+                pending.add(pool.submit(self._delete_batch, batch))
+            collect(wait(pending).done)
+        return deleted, failures
+
+    def create_multipart_upload(self, key: str) -> str:
+        return self._client().create_multipart_upload(
+            Bucket=self.bucket,
+            Key=key,
+            ContentType=mimetypes.guess_type(key)[0] or "application/octet-stream",
+        )["UploadId"]
+
+    def presign_part(self, key: str, upload_id: str, part_number: int, expires_in: int) -> str:
+        return self._client().generate_presigned_url(
+            PresignedUrlType.UPLOAD_PART.value,
+            Params={
+                "Bucket": self.bucket,
+                "Key": key,
+                "UploadId": upload_id,
+                "PartNumber": part_number,
+            },
+            ExpiresIn=expires_in,
+        )
+
+    def complete_multipart_upload(self, key: str, upload_id: str, parts: list[dict]) -> None:
+        try:
+            self._client().complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={
+                    "Parts": [
+                        {"PartNumber": part["part_number"], "ETag": part["etag"]}
+                        for part in sorted(parts, key=lambda part: part["part_number"])
+                    ],
+                },
+            )
+        except ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code == "NoSuchUpload":
+                raise UploadNotFound(upload_id) from e
+            if code in ("InvalidPart", "InvalidPartOrder", "EntityTooSmall"):
+                raise InvalidUpload(e.response["Error"].get("Message", code)) from e
+            raise
+
+    def abort_multipart_upload(self, key: str, upload_id: str) -> None:
+        try:
+            self._client().abort_multipart_upload(
+                Bucket=self.bucket,
+                Key=key,
+                UploadId=upload_id,
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "NoSuchUpload":
+                raise
+
+    def list_multipart_uploads(self, prefix: str) -> Iterator[dict]:
+        params = {
+            "Bucket": self.bucket,
+            "Prefix": prefix,
+        }
+        while True:
+            res = self._client().list_multipart_uploads(**params)
+            for upload in res.get("Uploads", []):
+                yield {"key": upload["Key"], "upload_id": upload["UploadId"], "initiated": upload["Initiated"]}
+            if not res.get("IsTruncated"):
+                return
+            params["KeyMarker"] = res["NextKeyMarker"]
+            params["UploadIdMarker"] = res["NextUploadIdMarker"]
+
+    async def list_keys_async(self, prefix: str, start_after: Optional[str] = None, page_size: int = 1000) -> AsyncIterator[str]:
+        params = self._list_params(prefix, start_after, page_size)
+        while True:
+            async with self._async_s3() as client:
+                res = await client.list_objects_v2(**params)
+            for item in res.get("Contents", []):
+                yield item["Key"]
+            if not res.get("IsTruncated"):
+                return
+            params["ContinuationToken"] = res["NextContinuationToken"]
+
+    async def upload_async(self, data: bytes, key: str) -> None:
+        async with self._async_s3() as client:
+            await client.put_object(
+                Bucket=self.bucket,
+                Key=key,
+                Body=data,
+            )
+
+    async def info_async(self, key: str) -> Optional[dict]:
+        try:
+            async with self._async_s3() as client:
+                res = await client.head_object(
+                    Bucket=self.bucket,
+                    Key=key,
+                )
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey", "NotFound"):
+                raise
+            return None
+        return self._info(res)
+
+    async def stream_async(self, key: str, start: int = 0, end: Optional[int] = None, etag: Optional[str] = None, chunk_size: int = _STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        try:
+            async with self._async_s3() as client:
+                body = (await client.get_object(**self._get_params(key, start, end, etag)))["Body"]
+        except ClientError as e:
+            if etag is None or e.response["Error"]["Code"] not in _OBJECT_CHANGED_CODES:
+                raise
+            raise ObjectChanged(f"{key} does not have the ETag {etag} any more") from e
+        return self._iter_body(body, chunk_size)
+
+    @staticmethod
+    async def _iter_body(body, chunk_size: int) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in body.iter_chunks(chunk_size):
+                yield chunk
+        finally:
+            body.close()
+
+    async def delete_async(self, key: str) -> None:
+        async with self._async_s3() as client:
+            await client.delete_object(
+                Bucket=self.bucket,
+                Key=key,
+            )
+
+    async def close_async(self) -> None:
+        if self._async_client_context is not None and self._async_client_loop is asyncio.get_running_loop():
+            await self._async_client_context.__aexit__(None, None, None)
+        self._async_client, self._async_client_context, self._async_client_loop, self._async_semaphore = None, None, None, None
+
+
+class _FileRange:
+    """
+        Reads a byte range of an open file.
+    """
+
+    def __init__(self, file: BinaryIO, start: int, end: Optional[int]):
+        file.seek(start)
+        self.file = file
+        self.remaining = end - start + 1 if end is not None else None
+
+    def read(self, size: int = -1) -> bytes:
+        if self.remaining is not None:
+            size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        return data
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class LocalBackend:
+    """
+        Stores the objects as files below a local directory. Presigned urls
+        point to the app itself (routers/local_storage.py) and are signed with
+        an HMAC of the operation, the key and the expiry time.
+    """
+
+    def __init__(self, root: str = _LOCAL_ROOT, base_url: str = _LOCAL_BASE_URL, secret: str = _LOCAL_SECRET):
+        self.root = os.path.abspath(root)
+        self.base_url = base_url.rstrip("/")
+        self.secret = secret.encode()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if path != self.root and not path.startswith(self.root + os.sep):
+            raise ValueError(f"Invalid key {key}")
+        return path
+
+    def _signature(self, *fields) -> str:
+        return hmac.new(self.secret, "\n".join(map(str, fields)).encode(), hashlib.sha256).hexdigest()
+
+    def verify(self, key: str, type: PresignedUrlType, expires: int, signature: str) -> bool:
+        """
+            Checks a signature of a url created by presign.
+        """
+        return expires >= time.time() and hmac.compare_digest(self._signature(type.value, key, expires), signature)
+
+    def verify_part(self, key: str, upload_id: str, part_number: int, expires: int, signature: str) -> bool:
+        """
+            Checks a signature of a url created by presign_part.
+        """
+        expected = self._signature(PresignedUrlType.UPLOAD_PART.value, key, upload_id, part_number, expires)
+        return expires >= time.time() and hmac.compare_digest(expected, signature)
+
+    def list_keys(self, prefix: str, start_after: Optional[str] = None, page_size: int = 1000) -> Iterator[str]:
+        # only walk the deepest directory that contains the whole prefix
+        directory = self._path(prefix[:prefix.rfind("/") + 1])
+        keys = []
+        for dirpath, dirnames, filenames in os.walk(directory):
+            if dirpath == self.root and _LOCAL_MULTIPART_DIR in dirnames:
+                dirnames.remove(_LOCAL_MULTIPART_DIR)
+            for filename in filenames:
+                if filename.startswith(_LOCAL_UPLOAD_PREFIX):
+                    continue
+                key = os.path.relpath(os.path.join(dirpath, filename), self.root).replace(os.sep, "/")
+                if key.startswith(prefix) and (start_after is None or key > start_after):
+                    keys.append(key)
+        yield from sorted(keys)
+
+    def presign(self, key: str, type: PresignedUrlType, expires_in: int) -> str:
+        expires = int(time.time()) + expires_in
+        query = urlencode({"expires": expires, "signature": self._signature(type.value, key, expires)})
+        return f"{self.base_url}/storage/{quote(key)}?{query}"
+
+    def upload(self, file_obj: IOBase, key: str) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # readers never see a partially written file
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix=_LOCAL_UPLOAD_PREFIX, delete=False) as tmp:
+            shutil.copyfileobj(file_obj, tmp)
+        os.replace(tmp.name, path)
+
+    def info(self, key: str) -> Optional[dict]:
+        try:
+            stat = os.stat(self._path(key))
+        except FileNotFoundError:
+            return None
+        return {
+            "size": stat.st_size,
+            "etag": self._etag(stat),
+            "content_type": mimetypes.guess_type(key)[0] or "application/octet-stream",
+        }
+
+    @staticmethod
+    def _etag(stat: os.stat_result) -> str:
+        # uploads replace the file, so a new upload always changes the modification time
+        return '"' + hashlib.md5(f"{stat.st_mtime_ns}-{stat.st_size}".encode()).hexdigest() + '"'
+
+    def stream(self, key: str, start: int = 0, end: Optional[int] = None, etag: Optional[str] = None) -> BinaryIO:
+        try:
+            file = open(self._path(key), "rb")
+        except FileNotFoundError as e:
+            if etag is None:
+                raise
+            raise ObjectChanged(f"{key} does not exist any more") from e
+        # the open file keeps its content when it is replaced, so check the ETag of what was opened
+        if etag is not None and self._etag(os.fstat(file.fileno())) != etag:
+            file.close()
+            raise ObjectChanged(f"{key} does not have the ETag {etag} any more")
+        return _FileRange(file, start, end)
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def delete_prefix(self, prefix: str) -> tuple[int, list[dict]]:
+        deleted = 0
+        failures = []
+        for key in list(self.list_keys(prefix)):
+            try:
+                self.delete(key)
+                deleted += 1
+            except OSError as e:
+                failures.append({"key": key, "code": type(e).__name__, "message": str(e)})
+        return deleted, failures
+
+    def _upload_dir(self, key: str, upload_id: str) -> str:
+        # upload ids are created by create_multipart_upload, anything else could escape the root
+        directory = os.path.join(self.root, _LOCAL_MULTIPART_DIR, upload_id)
+        if not re.fullmatch(r"[0-9a-f]{32}", upload_id):
+            raise UploadNotFound(upload_id)
+        try:
+            with open(os.path.join(directory, "upload.json")) as file:
+                upload = json.load(file)
+        except FileNotFoundError:
+            raise UploadNotFound(upload_id)
+        if upload["key"] != key:
+            raise UploadNotFound(upload_id)
+        return directory
+
+    def create_multipart_upload(self, key: str) -> str:
+        self._path(key)
+        upload_id = uuid.uuid4().hex
+        directory = os.path.join(self.root, _LOCAL_MULTIPART_DIR, upload_id)
+        os.makedirs(directory)
+        with open(os.path.join(directory, "upload.json"), "w") as file:
+            json.dump({"key": key, "initiated": time.time()}, file)
+        return upload_id
+
+    def presign_part(self, key: str, upload_id: str, part_number: int, expires_in: int) -> str:
+        expires = int(time.time()) + expires_in
+        query = urlencode({
+            "upload_id": upload_id,
+            "part_number": part_number,
+            "expires": expires,
+            "signature": self._signature(PresignedUrlType.UPLOAD_PART.value, key, upload_id, part_number, expires),
+        })
+        return f"{self.base_url}/storage/{quote(key)}?{query}"
+
+    def upload_part(self, key: str, upload_id: str, part_number: int, file_obj: IOBase) -> str:
+        """
+            Stores one part of a multipart upload.
+
+            :return: The ETag (quoted) of the part
+        """
+        directory = self._upload_dir(key, upload_id)
+        digest = hashlib.md5()
+        with tempfile.NamedTemporaryFile(dir=directory, prefix=_LOCAL_UPLOAD_PREFIX, delete=False) as tmp:
+            while chunk := file_obj.read(1024 * 1024):
+                digest.update(chunk)
+                tmp.write(chunk)
+        # a part uploaded again gets a new file, complete picks the one with the given ETag
+        os.replace(tmp.name, os.path.join(directory, f"{part_number}-{digest.hexdigest()}"))
+        return f'"{digest.hexdigest()}"'
+
+    def complete_multipart_upload(self, key: str, upload_id: str, parts: list[dict]) -> None:
+        directory = self._upload_dir(key, upload_id)
+        parts = sorted(parts, key=lambda part: part["part_number"])
+        if len({part["part_number"] for part in parts}) != len(parts):
+            raise InvalidUpload("Every part number may only be given once")
+        paths = []
+        for part in parts:
+            path = os.path.join(directory, f"{part['part_number']}-" + part["etag"].strip('"'))
+            if not os.path.isfile(path):
+                raise InvalidUpload(f"Part {part['part_number']} was not uploaded with ETag {part['etag']}")
+            paths.append(path)
+        destination = self._path(key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(destination), prefix=_LOCAL_UPLOAD_PREFIX, delete=False) as tmp:
+            for path in paths:
+                with open(path, "rb") as part_file:
+                    shutil.copyfileobj(part_file, tmp)
+        os.replace(tmp.name, destination)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    def abort_multipart_upload(self, key: str, upload_id: str) -> None:
+        try:
+            directory = self._upload_dir(key, upload_id)
+        except UploadNotFound:
+            return
+        shutil.rmtree(directory, ignore_errors=True)
+
+    def list_multipart_uploads(self, prefix: str) -> Iterator[dict]:
+        uploads = []
+        try:
+            entries = os.scandir(os.path.join(self.root, _LOCAL_MULTIPART_DIR))
+        except FileNotFoundError:
+            return
+        with entries:
+            for entry in entries:
+                try:
+                    with open(os.path.join(entry.path, "upload.json")) as file:
+                        upload = json.load(file)
+                except (FileNotFoundError, NotADirectoryError):
+                    # completed or aborted in the meantime
+                    continue
+                if upload["key"].startswith(prefix):
+                    uploads.append({
+                        "key": upload["key"],
+                        "upload_id": entry.name,
+                        "initiated": datetime.fromtimestamp(upload["initiated"], timezone.utc),
+                    })
+        yield from sorted(uploads, key=lambda upload: (upload["key"], upload["initiated"]))
+
+    # file system calls block, the async methods run the sync ones in worker threads
+
+    async def list_keys_async(self, prefix: str, start_after: Optional[str] = None, page_size: int = 1000) -> AsyncIterator[str]:
+        for key in await anyio.to_thread.run_sync(lambda: list(self.list_keys(prefix, start_after, page_size))):
+            yield key
+
+    async def upload_async(self, data: bytes, key: str) -> None:
+        await anyio.to_thread.run_sync(lambda: self.upload(BytesIO(data), key))
+
+    async def info_async(self, key: str) -> Optional[dict]:
+        return await anyio.to_thread.run_sync(self.info, key)
+
+    async def stream_async(self, key: str, start: int = 0, end: Optional[int] = None, etag: Optional[str] = None, chunk_size: int = _STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        body = await anyio.to_thread.run_sync(self.stream, key, start, end, etag)
+        return self._iter_body(body, chunk_size)
+
+    @staticmethod
+    async def _iter_body(body: BinaryIO, chunk_size: int) -> AsyncIterator[bytes]:
+        try:
+            while chunk := await anyio.to_thread.run_sync(body.read, chunk_size):
+                yield chunk
+        finally:
+            body.close()
+
+    async def delete_async(self, key: str) -> None:
+        await anyio.to_thread.run_sync(self.delete, key)
+
+    async def close_async(self) -> None:
+        pass
+
+
+class LatencyBackend:
+    """
+        Delays every operation of another backend by a fixed time, to simulate
+        a remote object store.
+    """
+
+    def __init__(self, backend: StorageBackend, latency_ms: float):
+        self.backend = backend
+        self.latency = latency_ms / 1000
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.backend, name)
+        if not callable(attr):
+            return attr
+
+        if inspect.isasyncgenfunction(attr):
+            async def delayed_iterator(*args, **kwargs):
+                await asyncio.sleep(self.latency)
+                async for item in attr(*args, **kwargs):
+                    yield item
+            return delayed_iterator
+
+        if inspect.iscoroutinefunction(attr):
+            async def delayed_coroutine(*args, **kwargs):
+                await asyncio.sleep(self.latency)
+                return await attr(*args, **kwargs)
+            return delayed_coroutine
+
+        def delayed(*args, **kwargs):
+            time.sleep(self.latency)
+            return attr(*args, **kwargs)
+        return delayed
+
+
+def create_backend(name: str = STORAGE_BACKEND, latency_ms: float = _LATENCY_MS) -> StorageBackend:
+    if name == "s3":
+        backend = S3Backend()
+    elif name == "local":
+        backend = LocalBackend()
+    else:
+        raise ValueError(f"Unknown storage backend {name}")
+    if latency_ms > 0:
+        backend = LatencyBackend(backend, latency_ms)
+    return backend